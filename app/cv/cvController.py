@@ -1,30 +1,28 @@
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
-from contextlib import contextmanager
+import json
 import os
 from typing import List, Optional
-from fastapi import APIRouter, Body, Depends, File, Query, UploadFile, BackgroundTasks, HTTPException, status
+from fastapi import APIRouter, Body, Depends, File, Query, Request, UploadFile, BackgroundTasks, HTTPException, status
+from fastapi.responses import StreamingResponse
 from requests import Session
 from sqlalchemy import func
-from db.session import SessionLocal
 
 from app.auth.authDTO import UserToken
 from app.auth.authService import get_user_current
-from app.cv.cvService import fetch_background_check_result, get_token, \
-    analyze_and_update_vitae_offers, process_existing_vitae_records, \
-    process_file_text, upload_batch
-from app.cv.vitaeOfferDTO import CVitaeResponseDTO, CampaignRequestDTO, UpdateVitaeOfferStatusDTO, UserResponseSchema, VitaeOfferResponseDTO
+from app.cv.cvJobs import enqueue_existing_cvs, enqueue_uploaded_cvs
+from app.cv.cvService import fetch_background_check_result, find_known_cvs, get_token, \
+    release_spooled_files, rescore_offer, spool_upload_file, sweep_spool_dir, upload_batch
+from app.cv.vitaeOfferDTO import CVitaeResponseDTO, CampaignRequestDTO, HetWeightsDTO, UpdateVitaeOfferStatusDTO, UserResponseSchema, VitaeOfferResponseDTO
 from app.deps import get_db
-from models.models import Cargo, Company, Offer, CVitae, OfferSkill, Skill, UserEnum, VitaeOffer
+from models.models import Cargo, Company, CompanyOffer, Offer, CVitae, OfferSkill, Skill, UserEnum, VitaeOffer
 import requests
 from requests.auth import HTTPBasicAuth
 from datetime import datetime
-from app.utils.thread_manager import ThreadPoolManager
-from uuid import uuid4
+from app.utils.job_queue import job_queue
 
 cvRouter = APIRouter()
 cvRouter.tags = ['CV']
-thread_pool_manager = ThreadPoolManager(max_workers=1)
+
 
 @cvRouter.post("/offers/upload-cvs/", status_code=201, response_model=None)
 async def upload_cvs(
@@ -68,43 +66,40 @@ async def upload_cvs(
     offer_skills = db.query(Skill).join(OfferSkill).filter(OfferSkill.offerId == offerId).all()
     if not offer_skills:
         raise HTTPException(status_code=404, detail="No skills found for the given offer.")
-    skills_list = [skill.name for skill in offer_skills]
-
-    # Extract offer details
-    city_offer = offer.city
-    age_offer = offer.age
-    genre_offer = offer.gender
-    experience_offer = offer.experience_years
-
-    pfiles = []
-    for file in files:
-        uname = str(uuid4())
-        fileobj = {}
-        fileobj["extension"] = file.filename.split('.')[-1].lower()
-        fileobj["name"] = f"{uname}.{fileobj['extension']}"
-        fileobj["content"] = file.file.read()
-        file.file.seek(0)
-        fileobj["file"] = file
-        pfiles.append(fileobj)
-
-    # Split files into batches
-    file_batches = [pfiles[i:i + 5] for i in range(0, len(pfiles), 5)]
-
-    # Process all batches with delay
-    tasks = []
-    for batch in file_batches:
-        urls = upload_batch(batch, company_name)
-        if urls is None or urls == []:
-            raise HTTPException(status_code=500, detail="There was an error uploading files")
-        tasks.append(
-            thread_pool_manager.submit_task(
-                offerId, process_file_text, batch, companyId, company_name,
-                db, urls, skills_list, city_offer, age_offer, genre_offer,
-                experience_offer, offerId
-            )
-        )
 
-    return {"detail": "Processing files", "tasks": tasks}
+    loop = asyncio.get_event_loop()
+
+    # Spool every upload to a temporary file, text is read lazily on extraction
+    pfiles = await loop.run_in_executor(
+        None, lambda: [spool_upload_file(file) for file in files])
+    # Files left behind by jobs that ran elsewhere
+    await loop.run_in_executor(None, sweep_spool_dir)
+
+    # CVs seen before skip the upload and extraction, and go straight to scoring
+    pfiles, reused_ids, duplicates = find_known_cvs(db, pfiles, companyId, offerId)
+    release_spooled_files(duplicates)
+    tasks = []
+    if reused_ids:
+        tasks.extend(enqueue_existing_cvs(offerId, companyId, reused_ids))
+    if not pfiles:
+        return {"detail": "Processing files", "tasks": tasks, "uploads": [],
+                "reused": reused_ids, "duplicates": len(duplicates)}
+
+    # Upload all files to S3 concurrently without blocking the event loop
+    uploads = await loop.run_in_executor(None, upload_batch, pfiles, company_name)
+    urls = {upload["name"]: upload["url"] for upload in uploads if upload["error"] is None}
+    release_spooled_files([file for file in pfiles if file["name"] not in urls])
+    pfiles = [file for file in pfiles if file["name"] in urls]
+    if not pfiles:
+        raise HTTPException(status_code=500, detail="There was an error uploading files")
+
+    # Files are extracted together and packed into LLM requests by token count
+    # Queued durably with the S3 URLs, workers on other nodes download the files again
+    # Large uploads are split into several jobs, the response lists all of them
+    tasks.extend(enqueue_uploaded_cvs(offerId, companyId, pfiles, urls))
+
+    return {"detail": "Processing files", "tasks": tasks, "uploads": uploads,
+            "reused": reused_ids, "duplicates": len(duplicates)}
 
 @cvRouter.get("/background-check/{cvitae_id}")
 async def background_check(cvitae_id: int, db: Session = Depends(get_db), userToken: UserToken = Depends(get_user_current), background_tasks: BackgroundTasks = BackgroundTasks()):
@@ -232,6 +227,7 @@ def get_cvoffers_by_offer(
             VitaeOffer.whatsapp_status,
             VitaeOffer.smartdataId,
             VitaeOffer.response_score,
+            VitaeOffer.matched_skills,
             VitaeOffer.status,
             VitaeOffer.comments,
             VitaeOffer.created_date,
@@ -268,6 +264,7 @@ def get_cvoffers_by_offer(
                 smartdataId=row.smartdataId,
                 whatsapp_status=row.whatsapp_status,
                 response_score=row.response_score,
+                matched_skills=row.matched_skills,
                 status=row.status,
                 comments=row.comments,
                 created_date=row.created_date,
@@ -531,6 +528,8 @@ def get_cvitae_by_company(
 async def process_existing_cvs(
     offerId: int,
     cvitae_ids: List[int],
+    reextract: bool = Query(False, description="Re-extract CV texts with the current extractor before scoring"),
+    skip_prerank: bool = Query(False, description="Send every CV to the LLM, e.g. the ones pre-ranking left \"Sin evaluar\""),
     db: Session = Depends(get_db),
     userToken: UserToken = Depends(get_user_current)
 ):
@@ -547,73 +546,52 @@ async def process_existing_cvs(
     if not offer or not offer.active:
         raise HTTPException(status_code=404, detail="Offer not found or is inactive")
 
-    # Extract skills and offer details
+    if not cvitae_ids:
+        raise HTTPException(status_code=400, detail="No CVitae IDs provided.")
+
+    # The job loads the skills and offer details when it runs
     offer_skills = db.query(Skill).join(OfferSkill).filter(OfferSkill.offerId == offerId).all()
     if not offer_skills:
         raise HTTPException(status_code=404, detail="No skills found for the given offer.")
-    skills_list = [skill.name for skill in offer_skills]
-    city_offer = offer.city
-    age_offer = offer.age
-    genre_offer = offer.gender
-    experience_offer = offer.experience_years
-
-    # Split `cvitae_ids` into batches of 10
-    batches = [cvitae_ids[i:i + 5] for i in range(0, len(cvitae_ids), 5)]
-
-    @contextmanager
-    def get_thread_safe_db():
-        """
-        Context manager to provide a thread-safe session.
-        """
-        db = SessionLocal()  # Create a new session for each thread
-        try:
-            yield db
-        finally:
-            db.close()
-
-    def process_batch(batch, offerId, skills_list, city_offer, age_offer, genre_offer, experience_offer):
-        """
-        Process a single batch of CVitae records in a thread-safe manner.
-        """
-        with get_thread_safe_db() as db:
-            # Use the updated `process_existing_vitae_records` method to handle the batch
-            process_existing_vitae_records(
-                cvitae_ids=batch,
-                offerId=offerId,
-                skills_list=skills_list,
-                city_offer=city_offer,
-                age_offer=age_offer,
-                genre_offer=genre_offer,
-                experience_offer=experience_offer,
-                db=db
-            )
 
-    async def process_batches():
-        """
-        Asynchronously process all batches using multithreading with delays.
-        """
-        loop = asyncio.get_event_loop()
-        with ThreadPoolExecutor() as executor:
-            for batch in batches:
-                # Process the current batch
-                await loop.run_in_executor(
-                    executor,
-                    process_batch,
-                    batch,
-                    offerId,
-                    skills_list,
-                    city_offer,
-                    age_offer,
-                    genre_offer,
-                    experience_offer
-                )
-                # Add a 2-second delay before processing the next batch
-                await asyncio.sleep(3)
+    found = db.query(func.count(CVitae.Id)).filter(CVitae.Id.in_(cvitae_ids)).scalar()
+    if found != len(set(cvitae_ids)):
+        raise HTTPException(status_code=404, detail="One or more CVitae records not found.")
+
+    # Process all batches in background jobs of at most JOB_MAX_ITEMS CVs,
+    # scheduled with the offer's company
+    company_offer = db.query(CompanyOffer).filter(CompanyOffer.offerId == offerId).first()
+    task_ids = enqueue_existing_cvs(offerId, company_offer.companyId if company_offer else None,
+                                    cvitae_ids, reextract, prerank=not skip_prerank)
+
+    return {"detail": "Processing existing CVitae records...", "task": task_ids[0],
+            "tasks": task_ids}
 
-    # Process all batches asynchronously
-    task_id = thread_pool_manager.submit_task(offerId, process_batches)
 
-    return {"detail": "Processing existing CVitae records...", "task": task_id}
+@cvRouter.post("/offers/{offer_id}/rescore", status_code=200, response_model=None)
+def rescore_offer_cvs(
+    offer_id: int,
+    weights: HetWeightsDTO = Body(HetWeightsDTO()),
+    db: Session = Depends(get_db),
+    userToken: UserToken = Depends(get_user_current)
+):
+    """
+    Recompute the score of every CV of an offer with the given HET weights,
+    from the features already extracted, without calling the LLM.
+    CVs scored afterwards use the configured weights.
+    """
+    if userToken.role not in [UserEnum.super_admin, UserEnum.company, UserEnum.company_recruit, UserEnum.admin]:
+        raise HTTPException(status_code=403, detail="You do not have permission to access this endpoint.")
+
+    offer = db.query(Offer).filter(Offer.id == offer_id).first()
+    if not offer:
+        raise HTTPException(status_code=404, detail="Offer not found")
+
+    try:
+        rescored = rescore_offer(db, offer_id, (weights.skills, weights.experience, weights.tenure))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"detail": "Offer rescored", "rescored": rescored}
 
 
 @cvRouter.get("/task/{task_id}", status_code=200, response_model=None)
@@ -625,7 +603,7 @@ def get_task_status(
     """
     Retrieve the current status of a background task
     """
-    status = thread_pool_manager.get_task(task_id)
+    status = job_queue.get_task(task_id)
     if status is None:
         raise HTTPException(status_code=404, detail="Task not found.")
     return status
@@ -633,12 +611,74 @@ def get_task_status(
 
 @cvRouter.get("/task", status_code=200, response_model=None)
 def get_tasks(
-    task_id: str,
+    offer_id: Optional[int] = Query(None, description="List the latest tasks of this offer instead of the running ones"),
     db: Session = Depends(get_db),
     userToken: UserToken = Depends(get_user_current)
 ):
     """
-    Retrieve the current status of a background task
+    Retrieve the status of the queued and running background tasks, or of
+    the latest tasks of an offer
     """
-    status_list = thread_pool_manager.get_tasks()
+    status_list = job_queue.get_tasks(offer_id)
     return status_list
+
+
+async def server_sent_events(request: Request, offer_id=None, task_ids=None):
+    """
+    Format the changes of the watched jobs as Server-Sent Events, until the
+    client disconnects. Pings are sent as comments to keep the connection open.
+    """
+    events = job_queue.watch(offer_id=offer_id, task_ids=task_ids)
+    try:
+        async for event, data in events:
+            if await request.is_disconnected():
+                break
+            if event == "ping":
+                yield ": ping\n\n"
+            else:
+                yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+    finally:
+        await events.aclose()
+
+
+@cvRouter.get("/offers/{offer_id}/events", status_code=200, response_model=None)
+def stream_offer_events(
+    offer_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    userToken: UserToken = Depends(get_user_current)
+):
+    """
+    Stream the progress of the background tasks of an offer as Server-Sent
+    Events, starting with the tasks queued or running on connection
+    """
+    if userToken.role not in [UserEnum.super_admin, UserEnum.company, UserEnum.company_recruit, UserEnum.admin]:
+        raise HTTPException(status_code=403, detail="You do not have permission to access this endpoint.")
+
+    offer = db.query(Offer).filter(Offer.id == offer_id).first()
+    if not offer:
+        raise HTTPException(status_code=404, detail="Offer not found")
+    # The stream outlives the request, don't keep its connection checked out
+    db.close()
+
+    return StreamingResponse(server_sent_events(request, offer_id=offer_id),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@cvRouter.get("/tasks/events", status_code=200, response_model=None)
+def stream_task_events(
+    request: Request,
+    task_ids: List[str] = Query(..., description="Tasks of the group, e.g. the ones returned by an upload"),
+    userToken: UserToken = Depends(get_user_current)
+):
+    """
+    Stream the progress of a group of background tasks as Server-Sent
+    Events, the stream ends when all of them are finished
+    """
+    if any(job_queue.get_task(task_id) is None for task_id in set(task_ids)):
+        raise HTTPException(status_code=404, detail="Task not found.")
+
+    return StreamingResponse(server_sent_events(request, task_ids=task_ids),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
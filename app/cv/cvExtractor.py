@@ -0,0 +1,164 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+from docx import Document
+from PIL import Image
+import pytesseract
+import fitz
+
+# This module is imported by the extraction worker processes, keep it free
+# of app level state (DB sessions, S3 or OpenAI clients)
+
+pytesseract.pytesseract.tesseract_cmd = "/usr/bin/tesseract"
+
+
+
+class OcrProfile:
+    """
+    Rendering, preprocessing and Tesseract settings used to OCR scanned pages.
+    """
+
+    def __init__(self, dpi=200, max_side=2500, grayscale=True, threshold=None,
+                 lang="spa+eng", psm=3, oem=1, page_timeout=30):
+        self.dpi = dpi  # Resolution pages are rendered at
+        self.max_side = max_side  # Longest side in pixels, larger renders are downscaled
+        self.grayscale = grayscale  # Render a single gray channel instead of RGB
+        self.threshold = threshold  # Binarize at this gray level (0-255), None to skip
+        self.lang = lang  # Tesseract language packs
+        self.psm = psm  # Tesseract page segmentation mode
+        self.oem = oem  # Tesseract OCR engine mode
+        self.page_timeout = page_timeout  # Seconds before a page's OCR is abandoned
+
+    @classmethod
+    def from_env(cls):
+        threshold = os.getenv("OCR_THRESHOLD")
+        return cls(
+            dpi=int(os.getenv("OCR_DPI", "200")),
+            max_side=int(os.getenv("OCR_MAX_SIDE", "2500")),
+            grayscale=os.getenv("OCR_GRAYSCALE", "true").lower() == "true",
+            threshold=int(threshold) if threshold else None,
+            lang=os.getenv("OCR_LANG", "spa+eng"),
+            psm=int(os.getenv("OCR_PSM", "3")),
+            oem=int(os.getenv("OCR_OEM", "1")),
+            page_timeout=float(os.getenv("OCR_PAGE_TIMEOUT", "30")),
+        )
+
+    def tesseract_config(self) -> str:
+        return f"--oem {self.oem} --psm {self.psm}"
+
+
+DEFAULT_OCR_PROFILE = OcrProfile.from_env()
+
+# Bump whenever a change alters the extracted text, cached extractions made
+# by older versions are then ignored
+EXTRACTOR_VERSION = "3"
+
+# Tesseract runs as a subprocess, so scanned pages can be OCR'd from threads
+OCR_PAGE_WORKERS = int(os.getenv("OCR_PAGE_WORKERS", "2"))
+# Rendered pages waiting for or under OCR, bounds the memory per document
+OCR_MAX_INFLIGHT_PAGES = int(os.getenv("OCR_MAX_INFLIGHT_PAGES", "4"))
+
+
+def ocr_page_image(image: Image.Image, profile: OcrProfile) -> str:
+    try:
+        # Use Tesseract for OCR
+        return pytesseract.image_to_string(image, lang=profile.lang,
+                                           config=profile.tesseract_config(),
+                                           timeout=profile.page_timeout)
+    except RuntimeError as e:
+        # pytesseract raises RuntimeError when the page timeout is hit
+        print(f"OCR of page skipped: {str(e)}")
+        return ""
+    finally:
+        # Ensure image resources are freed
+        image.close()
+
+def render_page(page, profile: OcrProfile) -> Image.Image:
+    """
+    Render a single PDF page to a PIL image ready for OCR.
+    """
+    colorspace = fitz.csGRAY if profile.grayscale else fitz.csRGB
+    pixmap = page.get_pixmap(dpi=profile.dpi, colorspace=colorspace, alpha=False)
+    mode = "L" if profile.grayscale else "RGB"
+    image = Image.frombytes(mode, (pixmap.width, pixmap.height), pixmap.samples)
+
+    # Downscale oversized renders, they slow Tesseract without adding accuracy
+    if max(image.size) > profile.max_side:
+        image.thumbnail((profile.max_side, profile.max_side), Image.LANCZOS)
+
+    if profile.threshold is not None:
+        gray = image if image.mode == "L" else image.convert("L")
+        image = gray.point(lambda value: 255 if value > profile.threshold else 0)
+    return image
+
+def extract_text_from_pdf(file_path: str, profile: OcrProfile = None) -> dict:
+    """
+    Extract the text of a PDF page by page. Pages with a text layer are read
+    with PyMuPDF, pages without one are rendered one at a time and OCR'd in
+    parallel, with at most OCR_MAX_INFLIGHT_PAGES images in memory.
+    Returns the text, the page count and the method used.
+    """
+    profile = profile or DEFAULT_OCR_PROFILE
+    pages = []
+    inflight = threading.BoundedSemaphore(OCR_MAX_INFLIGHT_PAGES)
+
+    def release_slot(future):
+        inflight.release()
+
+    executor = ThreadPoolExecutor(max_workers=OCR_PAGE_WORKERS)
+    try:
+        with fitz.open(file_path, filetype="pdf") as pdf_doc:
+            for page in pdf_doc:
+                page_text = page.get_text("text")
+                if page_text.strip():
+                    pages.append(page_text)
+                    continue
+
+                # No text layer, assume it's a scanned page and OCR it
+                inflight.acquire()
+                try:
+                    future = executor.submit(ocr_page_image, render_page(page, profile),
+                                             profile)
+                except Exception:
+                    inflight.release()
+                    raise
+                future.add_done_callback(release_slot)
+                pages.append(future)
+
+            text = "".join(page if isinstance(page, str) else page.result() + "\n"
+                           for page in pages)
+    except BaseException:
+        # E.g. the task timed out: drop the queued pages and don't wait for the
+        # running ones, they stop at their page timeout, so the worker process
+        # is free well within the process pool's grace period
+        for page in pages:
+            if not isinstance(page, str):
+                page.cancel()
+        executor.shutdown(wait=False)
+        raise
+    executor.shutdown()
+
+    ocr_pages = sum(1 for page in pages if not isinstance(page, str))
+    if ocr_pages == 0:
+        method = "text_layer"
+    elif ocr_pages == len(pages):
+        method = "ocr"
+    else:
+        method = "mixed"
+    return {"text": text.strip(), "page_count": len(pages), "method": method}
+
+def extract_text_from_docx(file_path: str) -> dict:
+    doc = Document(file_path)
+    text = "\n".join([para.text for para in doc.paragraphs])
+    return {"text": text, "page_count": None, "method": "docx"}
+
+def extract_text(file_path: str, file_extension: str) -> dict:
+    """
+    Extract the text of a CV based on its file type.
+    Returns a dict with the text, the page count and the method used.
+    """
+    if file_extension == 'pdf':
+        return extract_text_from_pdf(file_path)
+    elif file_extension in ['docx', 'doc']:
+        return extract_text_from_docx(file_path)
+    raise ValueError(f"Unsupported file format: {file_extension}")
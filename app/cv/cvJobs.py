@@ -0,0 +1,194 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List
+
+from fastapi import HTTPException
+
+from app.cv.cvService import find_known_cvs, load_cvitae_records, load_offer_criteria, \
+    process_existing_vitae_records, process_file_text, release_spooled_files, score_cv_texts
+from app.utils.job_queue import NORMAL_LANE, PRIORITY_LANE, JobFailed, job_queue
+from db.session import SessionLocal
+
+# Job kinds of the CV pipeline
+PROCESS_UPLOADED_CVS = "process_uploaded_cvs"
+SCORE_EXISTING_CVS = "score_existing_cvs"
+# Uploads and reprocess requests of at most this many CVs go in the priority lane
+JOB_SMALL_UPLOAD_FILES = int(os.getenv("JOB_SMALL_UPLOAD_FILES", "20"))
+# Most files or CVs of a job, larger requests are split so no job holds a worker for long
+JOB_MAX_ITEMS = int(os.getenv("JOB_MAX_ITEMS", "50"))
+
+
+@contextmanager
+def get_thread_safe_db():
+    """
+    Context manager to provide a thread-safe session.
+    """
+    db = SessionLocal()  # Create a new session for each thread
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def load_cv_texts(cvitae_ids, reextract=False):
+    """
+    Load the CV texts of CVitae records in a thread-safe manner.
+    """
+    with get_thread_safe_db() as db:
+        return [cvitae.cvtext for cvitae in load_cvitae_records(db, cvitae_ids, reextract)]
+
+
+def process_batch(batch, offerId, candidates):
+    """
+    Persist the scores of a batch of CVitae records in a thread-safe manner.
+    Returns the IDs that could not be scored.
+    """
+    with get_thread_safe_db() as db:
+        # Use the updated `process_existing_vitae_records` method to handle the batch
+        return process_existing_vitae_records(
+            cvitae_ids=batch,
+            offerId=offerId,
+            db=db,
+            candidates=candidates
+        )
+
+
+def report_progress(key, status, error=None, done=False):
+    """
+    Record the status of a file or CV in the progress of the running job.
+    """
+    progress = job_queue.progress()
+    if progress is not None:
+        progress.update(key, status, error, done)
+
+
+async def score_existing_cvs(cvitae_ids, offerId, skills_list, city_offer, age_offer, genre_offer,
+                             experience_offer, reextract=False, offer_text="",
+                             report=report_progress, prerank=True):
+    """
+    Score existing CVitae records for an offer, concurrently with the async
+    OpenAI client, and persist the results in a thread.
+    CVs that could not be scored do not prevent saving the rest.
+    """
+    cvitae_ids = list(dict.fromkeys(cvitae_ids))
+    loop = asyncio.get_event_loop()
+    with ThreadPoolExecutor() as executor:
+        cv_texts = await loop.run_in_executor(executor, load_cv_texts, cvitae_ids, reextract)
+        candidates = await score_cv_texts(cv_texts, skills_list, city_offer, age_offer,
+                                          genre_offer, experience_offer, offer_text, prerank)
+        for cvitae_id, candidate_data in zip(cvitae_ids, candidates):
+            if not isinstance(candidate_data, Exception):
+                report(cvitae_id, "scored")
+        failed = await loop.run_in_executor(executor, process_batch, cvitae_ids, offerId,
+                                            candidates)
+
+    for cvitae_id, candidate_data in zip(cvitae_ids, candidates):
+        if isinstance(candidate_data, Exception):
+            report(cvitae_id, "failed", f"Scoring failed: {str(candidate_data)}", done=True)
+        elif cvitae_id in failed:
+            report(cvitae_id, "failed", "Could not be saved", done=True)
+        else:
+            report(cvitae_id, "persisted", done=True)
+    if failed:
+        raise JobFailed(f"{len(failed)} of {len(cvitae_ids)} CVs could not be scored: {failed}")
+
+
+def load_job_criteria(offer_id):
+    try:
+        with get_thread_safe_db() as db:
+            return load_offer_criteria(db, offer_id)
+    except HTTPException as e:
+        raise JobFailed(e.detail)
+
+
+@job_queue.handler(SCORE_EXISTING_CVS)
+async def score_existing_cvs_job(offer_id: int, cvitae_ids: List[int], reextract: bool = False,
+                                 prerank: bool = True):
+    """
+    Score CVitae records already stored for an offer.
+    """
+    criteria = load_job_criteria(offer_id)
+    job_queue.progress().set_total(len(set(cvitae_ids)))
+    await score_existing_cvs(cvitae_ids, offer_id, reextract=reextract, prerank=prerank,
+                             **criteria)
+
+
+@job_queue.handler(PROCESS_UPLOADED_CVS)
+def process_uploaded_cvs_job(offer_id: int, company_id: int, files: List[dict], urls: dict):
+    """
+    Extract, score and store CVs uploaded to S3 for an offer.
+    CVs stored by an earlier attempt of the job are skipped, and CVs the
+    company already had are scored as existing records.
+    """
+    criteria = load_job_criteria(offer_id)
+    # Pipeline stages run in their own threads, they report to this job's progress
+    progress = job_queue.progress()
+    progress.set_total(len(files))
+    with get_thread_safe_db() as db:
+        # Files are only fetched from S3 by the pipeline, once known ones are left out
+        batch, reused_ids, duplicates = find_known_cvs(db, files, company_id, offer_id)
+    release_spooled_files(duplicates)
+    for file in duplicates:
+        progress.update(file["name"], "duplicate", done=True)
+    reused_error = None
+    if reused_ids:
+        try:
+            asyncio.run(score_existing_cvs(reused_ids, offer_id, **criteria))
+        except JobFailed as e:
+            # Reused CVs that failed don't keep the new files from being processed
+            reused_error = e
+    if batch:
+        try:
+            process_file_text(batch, company_id, urls, criteria["skills_list"],
+                              criteria["city_offer"], criteria["age_offer"],
+                              criteria["genre_offer"], criteria["experience_offer"],
+                              offer_id, criteria["offer_text"], progress.update)
+        except HTTPException as e:
+            if e.status_code < 500:
+                raise JobFailed(e.detail)
+            raise Exception(e.detail)
+    if reused_error is not None:
+        raise reused_error
+
+
+def split_items(items: list) -> List[list]:
+    """
+    Split the files or CVs of a request into the item lists of its jobs.
+    """
+    size = JOB_MAX_ITEMS if JOB_MAX_ITEMS > 0 else max(len(items), 1)
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def request_lane(items: list) -> int:
+    # The lane depends on the size of the whole request, not of its last job
+    return PRIORITY_LANE if len(items) <= JOB_SMALL_UPLOAD_FILES else NORMAL_LANE
+
+
+def enqueue_uploaded_cvs(offer_id: int, company_id: int, files: List[dict],
+                         urls: dict) -> List[str]:
+    priority = request_lane(files)
+    return [job_queue.enqueue(PROCESS_UPLOADED_CVS, {
+        "offer_id": offer_id,
+        "company_id": company_id,
+        "files": chunk,
+        "urls": {file["name"]: urls[file["name"]] for file in chunk if file["name"] in urls},
+    }, offer_id=offer_id, company_id=company_id,
+        results={file["name"]: {"status": "uploaded", "filename": file.get("filename")}
+                 for file in chunk},
+        priority=priority) for chunk in split_items(files)]
+
+
+def enqueue_existing_cvs(offer_id: int, company_id: int, cvitae_ids: List[int],
+                         reextract: bool = False, prerank: bool = True) -> List[str]:
+    cvitae_ids = list(dict.fromkeys(cvitae_ids))
+    priority = request_lane(cvitae_ids)
+    return [job_queue.enqueue(SCORE_EXISTING_CVS, {
+        "offer_id": offer_id,
+        "cvitae_ids": chunk,
+        "reextract": reextract,
+        "prerank": prerank,
+    }, offer_id=offer_id, company_id=company_id,
+        results={str(cvitae_id): {"status": "queued"} for cvitae_id in chunk},
+        priority=priority) for chunk in split_items(cvitae_ids)]
@@ -0,0 +1,257 @@
+from datetime import date
+import os
+import re
+from typing import List, Optional, Tuple
+
+from app.utils.text_normalize import fold_text
+
+# Discard CVs that clearly miss the mandatory offer criteria before scoring
+PREFILTER_ENABLED = os.getenv("PREFILTER_ENABLED", "true").lower() == "true"
+
+# Minimum years of experience of each ExperienceYearsEnum value
+EXPERIENCE_YEARS = {0: 0, 1: 0.5, 2: 1, 3: 2, 4: 3, 5: 3}
+# genderEnum values that restrict the offer, and the words a CV uses for them
+GENDER_WORDS = {
+    1: ("masculino", "hombre", "male", "m"),
+    2: ("femenino", "mujer", "female", "f"),
+}
+# How each genderEnum value is named in the prompts
+GENDER_NAMES = {1: "Masculino", 2: "Femenino", 3: "Otro", 4: "Indiferente"}
+
+MONTHS = {"ene": 1, "jan": 1, "feb": 2, "mar": 3, "abr": 4, "apr": 4, "may": 5,
+          "jun": 6, "jul": 7, "ago": 8, "aug": 8, "sep": 9, "oct": 10, "nov": 11,
+          "dic": 12, "dec": 12}
+
+# Patterns run on folded text (lowercase, no accents, symbols as spaces)
+AGE_RANGE_RE = re.compile(r"(\d{2})\s*(?:a|y|hasta|to)?\s*(\d{2})")
+AGE_MIN_RE = re.compile(r"(?:mayor(?:es)? de|desde|mas de|\+)\s*(\d{2})|(\d{2})\s*(?:anos)?\s*(?:en adelante|o mas)")
+AGE_RE = re.compile(r"\bedad\s*(\d{2})\b|\b(\d{2})\s*anos de edad\b")
+BIRTH_DATE_RE = re.compile(
+    r"\b(?:fecha de nacimiento|nacimiento|nacido el|nacida el|f nacimiento)\s*"
+    r"(?:(\d{1,2})\s*(?:de\s*)?(\d{1,2}|[a-z]{3})[a-z]*\s*(?:de\s*)?)?((?:19|20)\d{2})\b")
+GENDER_RE = re.compile(r"\b(?:sexo|genero)\s*(masculino|femenino|hombre|mujer|male|female|m|f)\b")
+CITY_RE = re.compile(r"^\s*(?:ciudad de residencia|lugar de residencia|residencia|ciudad|domicilio)\b\s*"
+                     r"([a-z ]{3,40}?)(?=\s*(?:telefono|celular|movil|correo|email|direccion|edad|$))",
+                     re.MULTILINE)
+EXPERIENCE_RE = re.compile(r"\b(\d{1,2})\s*(?:anos|ano)\s*(?:de\s*)?experiencia\b")
+# Month of a date, by name ("enero de 2018") or number ("01/2018")
+DATE_MONTH = r"(?:([a-z]{3})[a-z]*\s*(?:de\s*)?|(0?[1-9]|1[0-2])\s+)?"
+DATE_SPAN_RE = re.compile(
+    rf"\b{DATE_MONTH}((?:19|20)\d{{2}})\s*(?:a|al|hasta|to)?\s*"
+    rf"(?:{DATE_MONTH}((?:19|20)\d{{2}})|(actual|actualmente|presente|present|hoy|la fecha))\b")
+
+
+def fold_lines(text: str) -> str:
+    """
+    Folded text that keeps one line per line of the CV.
+    """
+    return "\n".join(fold_text(line) for line in (text or "").splitlines())
+
+
+def parse_age_range(age_offer) -> Optional[Tuple[int, int]]:
+    """
+    Age range of an offer such as "18-35", "18 a 35" or "mayor de 25".
+    """
+    folded = fold_text(age_offer)
+    if not folded:
+        return None
+    match = AGE_RANGE_RE.search(folded)
+    if match:
+        low, high = sorted((int(match.group(1)), int(match.group(2))))
+        return low, high
+    match = AGE_MIN_RE.search(folded)
+    if match:
+        return int(match.group(1) or match.group(2)), 120
+    return None
+
+
+def extract_age(folded: str, today: date) -> Optional[int]:
+    match = AGE_RE.search(folded)
+    if match:
+        return int(match.group(1) or match.group(2))
+    match = BIRTH_DATE_RE.search(folded)
+    if match:
+        age = today.year - int(match.group(3))
+        month = match.group(2)
+        if month:
+            month = int(month) if month.isdigit() else MONTHS.get(month)
+            if month and month > today.month:
+                age -= 1
+        return age
+    return None
+
+
+def extract_gender(folded: str) -> Optional[int]:
+    match = GENDER_RE.search(folded)
+    if match:
+        for gender, words in GENDER_WORDS.items():
+            if match.group(1) in words:
+                return gender
+    return None
+
+
+def extract_city(folded: str) -> Optional[str]:
+    match = CITY_RE.search(folded)
+    return match.group(1).strip() if match else None
+
+
+def date_month(name: str, number: str, default: int) -> int:
+    if number:
+        return int(number)
+    return MONTHS.get(name, default)
+
+
+def extract_experience_years(folded: str, today: date) -> Optional[float]:
+    """
+    Years of experience stated in the CV ("5 años de experiencia"), or
+    covered by its date ranges ("2018 - actual", "03/2017 - 05/2024"),
+    whichever is larger. Ranges written in other formats are missed, so
+    the total can fall short of the real experience.
+    """
+    stated = [int(years) for years in EXPERIENCE_RE.findall(folded)]
+    spans = []
+    for start_name, start_number, start_year, end_name, end_number, end_year, current \
+            in DATE_SPAN_RE.findall(folded):
+        start = int(start_year) + (date_month(start_name, start_number, 1) - 1) / 12
+        if current:
+            end = today.year + (today.month - 1) / 12
+        else:
+            end = int(end_year) + (date_month(end_name, end_number, 12) - 1) / 12
+        if start <= end:
+            spans.append((start, end))
+    covered = 0.0
+    current_start = current_end = None
+    for start, end in sorted(spans):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                covered += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        covered += current_end - current_start
+    if not stated and not spans:
+        return None
+    return max(stated + [covered])
+
+
+def enum_value(value) -> Optional[int]:
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def experience_requirement(experience_offer) -> str:
+    """
+    Minimum years of experience of an offer as told to the LLM, from the
+    same mapping the pre-filter uses.
+    """
+    min_years = EXPERIENCE_YEARS.get(enum_value(experience_offer), 0)
+    if not min_years:
+        return "0 (no se requiere experiencia)"
+    return f"{min_years:g}"
+
+
+def gender_requirement(genre_offer) -> str:
+    """
+    Gender required by an offer as told to the LLM.
+    """
+    return GENDER_NAMES.get(enum_value(genre_offer), "Indiferente")
+
+
+def prefilter_cv(cv_text: str, city_offer, age_offer, genre_offer, experience_offer,
+                 today: date = None) -> List[str]:
+    """
+    Check a CV against the mandatory criteria of an offer (city, age, gender
+    and experience). Only data found explicitly in the CV is compared, a
+    criterion the CV says nothing about is not a reason to discard it.
+    Returns the reasons the CV misses the offer, empty when it may fit.
+    """
+    today = today or date.today()
+    folded = fold_lines(cv_text)
+    reasons = []
+
+    city = fold_text(city_offer)
+    if city and not re.search(rf"\b{re.escape(city)}\b", folded):
+        candidate_city = extract_city(folded)
+        if candidate_city and city not in candidate_city and candidate_city not in city:
+            reasons.append(f"Ciudad: {candidate_city}")
+
+    age_range = parse_age_range(age_offer)
+    if age_range:
+        age = extract_age(folded, today)
+        if age is not None and not age_range[0] <= age <= age_range[1]:
+            reasons.append(f"Edad: {age}")
+
+    gender = enum_value(genre_offer)
+    if gender in GENDER_WORDS:
+        candidate_gender = extract_gender(folded)
+        if candidate_gender is not None and candidate_gender != gender:
+            reasons.append(f"Género: {GENDER_WORDS[candidate_gender][0]}")
+
+    min_years = EXPERIENCE_YEARS.get(enum_value(experience_offer), 0)
+    if min_years:
+        years = extract_experience_years(folded, today)
+        if years is not None and years < min_years:
+            reasons.append(f"Experiencia: {round(years, 1)} años")
+
+    return reasons
+
+
+def is_borderline_profile(profile: dict, city_offer, age_offer, genre_offer, experience_offer) -> bool:
+    """
+    Whether checking a candidate profile against the offer needs judgement:
+    data the offer requires is missing from it, or its age or experience
+    is within a year of the offer limits.
+    """
+    if fold_text(city_offer) and not profile.get("ciudad"):
+        return True
+    age_range = parse_age_range(age_offer)
+    if age_range:
+        age = profile.get("edad")
+        if age is None or min(abs(age - age_range[0]), abs(age - age_range[1])) <= 1:
+            return True
+    if enum_value(genre_offer) in GENDER_WORDS and not profile.get("genero"):
+        return True
+    min_years = EXPERIENCE_YEARS.get(enum_value(experience_offer), 0)
+    if min_years:
+        years = profile.get("experiencia_en_anos")
+        if years is None or abs(years - min_years) < 1:
+            return True
+    return False
+
+
+def local_candidate(cv_text: str, status: str) -> dict:
+    """
+    Candidate data of a CV that is not sent to the LLM, shaped like the
+    scoring response so it is stored and listed the same way.
+    """
+    email = re.search(r"[\w.+-]+@[\w-]+\.[\w.-]+", cv_text or "")
+    phone = re.search(r"\b3\d{2}[\s-]?\d{3}[\s-]?\d{4}\b", cv_text or "")
+    return {
+        "nombre": None,
+        "cedula": None,
+        "tipo_documento": None,
+        "ciudad": None,
+        "habilidades_encontradas": [],
+        "habilidades_solicitadas": [],
+        "genero": None,
+        "movil": phone.group(0) if phone else None,
+        "correo": email.group(0) if email else None,
+        "score": 0.0,
+        "experiencia_en_anos": None,
+        "tiempo_promedio_en_cada_trabajo": None,
+        "nivel_educativo": None,
+        "edad": None,
+        "status": status,
+    }
+
+
+def rejected_candidate(cv_text: str, reasons: List[str]) -> dict:
+    """
+    Candidate data of a CV discarded by the pre-filter.
+    """
+    return dict(local_candidate(cv_text, "No apto"), prefiltro=reasons)
@@ -1,52 +1,387 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from io import BytesIO
+import hashlib
 import json
 import os
 import re
+import tempfile
 import time
 from typing import List
+from uuid import uuid4
 from aiohttp import ClientError
-from docx import Document
 from fastapi import UploadFile, HTTPException
 import openai
 from openai import OpenAIError
-from pdf2image import convert_from_bytes
-import pytesseract
+from pydantic import ValidationError
 from requests import Session
 import boto3
-import fitz
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 import requests
 from requests.auth import HTTPBasicAuth
+from sqlalchemy.dialects.postgresql import insert
 import traceback
-from app.utils.prompt import prompt
-
-from models.models import CVitae, VitaeOffer
-
-pytesseract.pytesseract.tesseract_cmd = "/usr/bin/tesseract"
+from app.cv.cvExtractor import EXTRACTOR_VERSION, extract_text
+from app.cv.cvPrefilter import PREFILTER_ENABLED, experience_requirement, gender_requirement, \
+    is_borderline_profile, local_candidate, prefilter_cv, rejected_candidate
+from app.cv.vitaeOfferDTO import CandidateProfilesResponseDTO, CandidatesResponseDTO
+from app.utils.process_manager import ProcessPoolManager
+from app.utils.stage_pipeline import Stage, StagedPipeline
+from app.utils.batch_planner import LLM_MAX_OUTPUT_TOKENS, plan_batches
+from app.utils.het_score import HET_WEIGHTS, het_scores
+from app.utils.prompt import PROFILE_PROMPT_VERSION, PROMPT_VERSION, profile_prompt, prompt
+from app.utils.model_router import ModelRoute, ModelRouter
+from app.utils.rate_limiter import backoff_delay, retry_after
+from app.utils.relevance_ranker import PRERANK_ENABLED, relevance_scores, select_relevant
+from app.utils.skill_matcher import SkillMatcher
+from app.utils.text_compactor import compact_cv_text, count_tokens
+
+from db.session import SessionLocal
+from models.models import CandidateProfile, CVitae, ExtractedText, Offer, OfferSkill, ScoringCache, Skill, \
+    VitaeOffer
 
 # s3_client = boto3.client('s3', aws_access_key_id='your_access_key', aws_secret_access_key='your_secret_key', region_name='your_region')
 
 # AWS S3 Bucket name
 BUCKET_NAME = os.getenv("BUCKET_NAME")
 
+# Number of files uploaded to S3 at the same time
+S3_UPLOAD_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY", "10"))
+# Threads used by a single multipart upload
+S3_PART_CONCURRENCY = 4
+
 s3_client = boto3.client(
     's3',
     aws_access_key_id= os.getenv("AWS_KEY"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_KEY")
+    aws_secret_access_key=os.getenv("AWS_SECRET_KEY"),
+    config=Config(max_pool_connections=S3_UPLOAD_CONCURRENCY * S3_PART_CONCURRENCY)
 )
 
+# Multipart settings so uploads stream the spooled file to S3 in chunks
+s3_transfer_config = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=S3_PART_CONCURRENCY,
+)
+
+s3_upload_executor = ThreadPoolExecutor(max_workers=S3_UPLOAD_CONCURRENCY)
+
+# Text extraction (PDF parsing, OCR, DOCX) is CPU bound, so it runs in a
+# pool of worker processes instead of the GIL bound worker threads
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(os.cpu_count() or 1)))
+EXTRACTION_TIMEOUT = float(os.getenv("EXTRACTION_TIMEOUT", "180"))
+extraction_engine = ProcessPoolManager(max_workers=EXTRACTION_WORKERS,
+                                       timeout=EXTRACTION_TIMEOUT)
+
+# Directory where incoming CVs are spooled until they are processed
+CV_SPOOL_DIR = os.getenv("CV_SPOOL_DIR", tempfile.gettempdir())
+SPOOL_CHUNK_SIZE = 1024 * 1024
+SPOOL_PREFIX = "cv-spool-"
+# Seconds a spooled file is kept. Jobs that run on another node, or never
+# run, don't remove the files of the node that received the upload; after
+# this they are swept and a late job downloads the file from S3 instead
+CV_SPOOL_TTL = int(os.getenv("CV_SPOOL_TTL", "3600"))
+_spool_sweep = {"last": 0.0}
+
 openai.api_key =  os.getenv("OAI_KEY")
 
-def upload_to_s3(file: UploadFile, s3_key: str) -> str:
+# Models each kind of LLM work is sent to
+model_router = ModelRouter.from_env()
+
+# Scoring prompts sent to OpenAI at the same time by a single process
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+# Attempts after a rate limit error before a batch fails
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+# Times a CV missing from a response is sent again on its own
+LLM_CANDIDATE_RETRIES = int(os.getenv("LLM_CANDIDATE_RETRIES", "2"))
+
+# Files that go through the ingestion pipeline together, and the workers of
+# each of its stages. Score workers each send up to LLM_CONCURRENCY requests
+PIPELINE_CHUNK_SIZE = int(os.getenv("PIPELINE_CHUNK_SIZE", "20"))
+PIPELINE_FETCH_WORKERS = int(os.getenv("PIPELINE_FETCH_WORKERS", "2"))
+PIPELINE_EXTRACT_WORKERS = int(os.getenv("PIPELINE_EXTRACT_WORKERS", "2"))
+PIPELINE_PREFILTER_WORKERS = int(os.getenv("PIPELINE_PREFILTER_WORKERS", "1"))
+PIPELINE_SCORE_WORKERS = int(os.getenv("PIPELINE_SCORE_WORKERS", "2"))
+PIPELINE_PERSIST_WORKERS = int(os.getenv("PIPELINE_PERSIST_WORKERS", "1"))
+
+def spool_upload_file(file: UploadFile) -> dict:
     """
-    Upload a file to S3 and return its URL.
+    Copy an uploaded CV to a temporary file in fixed size chunks, so the
+    content is never held in memory and outlives the request. The SHA-256
+    of the content is computed on the way to detect duplicated CVs.
     """
-    try:
-        # Reset the file pointer before uploading
+    extension = file.filename.split('.')[-1].lower()
+    size = 0
+    content_hash = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=CV_SPOOL_DIR, prefix=SPOOL_PREFIX,
+                                     suffix=f".{extension}", delete=False) as spool:
         file.file.seek(0)
+        while True:
+            chunk = file.file.read(SPOOL_CHUNK_SIZE)
+            if not chunk:
+                break
+            spool.write(chunk)
+            content_hash.update(chunk)
+            size += len(chunk)
+
+    return {
+        "extension": extension,
+        "name": f"{uuid4()}.{extension}",
+        "filename": file.filename,  # Name the client uploaded, it reports progress by it
+        "path": spool.name,
+        "size": size,
+        "content_hash": content_hash.hexdigest(),
+    }
+
+def release_spooled_files(batch: List[dict]):
+    """
+    Remove the temporary files created by `spool_upload_file`.
+    """
+    for file in batch:
+        try:
+            os.remove(file["path"])
+        except FileNotFoundError:
+            pass
+
+def sweep_spool_dir():
+    """
+    Remove the spooled files older than CV_SPOOL_TTL. Runs at most once
+    every tenth of the TTL.
+    """
+    now = time.time()
+    if now - _spool_sweep["last"] < CV_SPOOL_TTL / 10:
+        return
+    _spool_sweep["last"] = now
+    removed = 0
+    for entry in os.scandir(CV_SPOOL_DIR):
+        if not entry.name.startswith(SPOOL_PREFIX):
+            continue
+        try:
+            if now - entry.stat().st_mtime > CV_SPOOL_TTL:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    if removed:
+        print(f"Removed {removed} expired spooled CVs")
+
+def find_known_cvs(db: Session, batch: List[dict], companyId: int, offerId: int):
+    """
+    Split spooled files by content hash into new files, CVitae records that
+    can be reused for the offer and duplicates that are already assigned to it.
+    A CV known only to another company is copied into a new CVitae record for
+    this company, reusing its S3 object and extracted text.
+    Returns (new_files, reused_cvitae_ids, duplicated_files).
+    """
+    known = {}
+    for cvitae in db.query(CVitae).filter(
+            CVitae.content_hash.in_([file["content_hash"] for file in batch]),
+            CVitae.cvtext.isnot(None)).all():
+        # Prefer the record that belongs to the uploading company
+        current = known.get(cvitae.content_hash)
+        if current is None or (current.companyId != companyId and cvitae.companyId == companyId):
+            known[cvitae.content_hash] = cvitae
+
+    assigned = set()
+    if known:
+        assigned = {cvitae_id for (cvitae_id,) in db.query(VitaeOffer.cvitaeId).filter(
+            VitaeOffer.offerId == offerId,
+            VitaeOffer.cvitaeId.in_([cvitae.Id for cvitae in known.values()])).all()}
+
+    new_files, reused_ids, duplicates = [], [], []
+    seen = set()
+    for file in batch:
+        content_hash = file["content_hash"]
+        if content_hash in seen:
+            duplicates.append(file)
+            continue
+        seen.add(content_hash)
+
+        cvitae = known.get(content_hash)
+        if cvitae is None:
+            new_files.append(file)
+        elif cvitae.companyId == companyId and cvitae.Id in assigned:
+            duplicates.append(file)
+        elif cvitae.companyId == companyId:
+            reused_ids.append(cvitae.Id)
+        else:
+            copy = CVitae(
+                url=cvitae.url,
+                size=cvitae.size,
+                cvtext=cvitae.cvtext,
+                extension=cvitae.extension,
+                content_hash=content_hash,
+                companyId=companyId,
+                candidate_dni=cvitae.candidate_dni,
+                candidate_dni_type=cvitae.candidate_dni_type,
+                candidate_name=cvitae.candidate_name,
+                candidate_phone=cvitae.candidate_phone,
+                candidate_mail=cvitae.candidate_mail,
+                candidate_city=cvitae.candidate_city,
+            )
+            db.add(copy)
+            db.flush()
+            reused_ids.append(copy.Id)
+    db.commit()
+    return new_files, reused_ids, duplicates
+
+def download_from_s3(url: str, extension: str) -> dict:
+    """
+    Download a CV from S3 into a spooled temporary file.
+    """
+    match = re.match(r"https://(.+?).s3.amazonaws.com/(.+)", url)
+    if not match:
+        raise ValueError(f"Invalid S3 URL: {url}")
+    bucket_name, key = match.groups()
+
+    content_hash = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=CV_SPOOL_DIR, prefix=SPOOL_PREFIX,
+                                     suffix=f".{extension}", delete=False) as spool:
+        s3_client.download_fileobj(bucket_name, key, spool, Config=s3_transfer_config)
+    with open(spool.name, "rb") as downloaded:
+        for chunk in iter(lambda: downloaded.read(SPOOL_CHUNK_SIZE), b""):
+            content_hash.update(chunk)
+
+    return {
+        "extension": extension,
+        "name": key.split("/")[-1],
+        "path": spool.name,
+        "size": os.path.getsize(spool.name),
+        "content_hash": content_hash.hexdigest(),
+    }
+
+def restore_spooled_files(files: List[dict], urls: dict) -> List[dict]:
+    """
+    Spooled files of a job, from the local spool when the job runs where
+    they were uploaded, otherwise downloaded again from S3. Local files are
+    touched, so `sweep_spool_dir` doesn't remove them while the job uses them.
+    Files that can't be restored are skipped.
+    """
+    batch = []
+    for file in files:
+        try:
+            os.utime(file["path"])
+            batch.append(file)
+            continue
+        except FileNotFoundError:
+            pass
+        try:
+            downloaded = download_from_s3(urls[file["name"]], file["extension"])
+            batch.append(dict(downloaded, name=file["name"], filename=file.get("filename")))
+        except Exception as e:
+            print(f"Could not restore {file['name']}: {str(e)}")
+    return batch
 
-        # Upload file to S3
-        s3_client.upload_fileobj(file.file, BUCKET_NAME, s3_key)
+def load_offer_criteria(db: Session, offerId: int) -> dict:
+    """
+    Criteria CVs are scored against for an offer.
+    """
+    offer = db.query(Offer).filter(Offer.id == offerId).first()
+    if not offer:
+        raise HTTPException(status_code=404, detail="Offer not found")
+    offer_skills = db.query(Skill).join(OfferSkill).filter(OfferSkill.offerId == offerId).all()
+    if not offer_skills:
+        raise HTTPException(status_code=404, detail="No skills found for the given offer.")
+    return {
+        "skills_list": [skill.name for skill in offer_skills],
+        "city_offer": offer.city,
+        "age_offer": offer.age,
+        "genre_offer": offer.gender,
+        "experience_offer": offer.experience_years,
+        "offer_text": " ".join(filter(None, [offer.name, offer.duties, offer.exp_area])),
+    }
+
+def extract_with_cache(db: Session, batch: List[dict]) -> list:
+    """
+    Extract the text of spooled files, serving it from the extractedText
+    cache when the same content was extracted by the current extractor.
+    Returns one extraction dict per file, or the exception that made it fail.
+    """
+    cached = {
+        entry.content_hash: entry
+        for entry in db.query(ExtractedText).filter(
+            ExtractedText.content_hash.in_([file["content_hash"] for file in batch]),
+            ExtractedText.extractor_version == EXTRACTOR_VERSION).all()
+    }
+    misses = [file for file in batch if file["content_hash"] not in cached]
+
+    # Extract the text of every uncached CV in parallel worker processes
+    extracted = dict(zip(
+        [file["name"] for file in misses],
+        extraction_engine.run_all(
+            extract_text, [(file["path"], file["extension"]) for file in misses])))
+
+    for file in misses:
+        result = extracted[file["name"]]
+        if isinstance(result, Exception):
+            continue
+        db.execute(insert(ExtractedText).values(
+            content_hash=file["content_hash"],
+            extractor_version=EXTRACTOR_VERSION,
+            text=result["text"],
+            page_count=result["page_count"],
+            method=result["method"],
+        ).on_conflict_do_nothing())
+    db.commit()
+
+    results = []
+    for file in batch:
+        entry = cached.get(file["content_hash"])
+        if entry is not None:
+            results.append({"text": entry.text, "page_count": entry.page_count,
+                            "method": entry.method})
+        else:
+            results.append(extracted[file["name"]])
+    return results
+
+def refresh_cvitae_texts(db: Session, cvitae_records: List[CVitae]):
+    """
+    Bring the text of existing CVitae records up to the current extractor.
+    Only files missing from the extraction cache are fetched from S3 again.
+    """
+    files = []
+    try:
+        by_hash = {}
+        for cvitae in cvitae_records:
+            if cvitae.content_hash is None:
+                # Records created before hashing, fetch them to learn their hash
+                file = download_from_s3(cvitae.url, cvitae.extension)
+                cvitae.content_hash = file["content_hash"]
+                files.append(file)
+            by_hash.setdefault(cvitae.content_hash, []).append(cvitae)
+
+        # Download the files whose text is not cached for the current extractor
+        cached = {content_hash for (content_hash,) in db.query(ExtractedText.content_hash).filter(
+            ExtractedText.content_hash.in_(list(by_hash.keys())),
+            ExtractedText.extractor_version == EXTRACTOR_VERSION).all()}
+        downloaded = {file["content_hash"] for file in files}
+        for content_hash, records in by_hash.items():
+            if content_hash not in cached and content_hash not in downloaded:
+                files.append(download_from_s3(records[0].url, records[0].extension))
+        for file, result in zip(files, extract_with_cache(db, files)):
+            if isinstance(result, Exception):
+                print(f"Error extracting text from {file['name']}: {str(result)}")
+
+        texts = {entry.content_hash: entry.text for entry in db.query(ExtractedText).filter(
+            ExtractedText.content_hash.in_(list(by_hash.keys())),
+            ExtractedText.extractor_version == EXTRACTOR_VERSION).all()}
+        for content_hash, records in by_hash.items():
+            for cvitae in records:
+                if content_hash in texts:
+                    cvitae.cvtext = texts[content_hash]
+        db.commit()
+    finally:
+        release_spooled_files(files)
+
+def upload_to_s3(file_path: str, s3_key: str) -> str:
+    """
+    Upload a file to S3 and return its URL.
+    """
+    try:
+        # Stream the file from disk using a multipart upload
+        s3_client.upload_file(file_path, BUCKET_NAME, s3_key,
+                              Config=s3_transfer_config)
 
         # Construct and return the S3 URL
         s3_url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{s3_key}"
@@ -75,239 +410,854 @@ def delete_from_s3(url: str):
         print(f"Failed to delete file from S3: {str(e)}")
 
 
-def extract_text_from_pdf(file_content: bytes) -> str:
-    try:
-        # First, try to extract text using PyMuPDF
-        with fitz.open(stream=file_content, filetype="pdf") as pdf_doc:
-            text = ""
-            for page in pdf_doc:
-                page_text = page.get_text("text")
-                if page_text.strip():  # If text is found, assume it's not an image
-                    text += page_text
-
-            # If text was found, return it
-            if text.strip():
-                return text
-
-        # If no text, assume the PDF has images, so use OCR
-        # Convert PDF pages to images
-        images = convert_from_bytes(file_content)
-        ocr_text = ""
-
-        for image in images:
-            try:
-                # Use Tesseract for OCR
-                ocr_result = pytesseract.image_to_string(image, lang='eng')  # Adjust lang as needed
-                ocr_text += ocr_result + "\n"
-            finally:
-                # Ensure image resources are freed
-                image.close()
+def clean_symbols(text):
+  return re.sub(r'[^a-záéíóúA-Z0-9\s]', '', text)
 
-        return ocr_text.strip()  # Return the OCR text
 
+def upload_file_timed(file: dict, s3_key: str) -> dict:
+    """
+    Upload a single spooled file and report its URL, duration and error.
+    """
+    start = time.perf_counter()
+    url, error = None, None
+    try:
+        url = upload_to_s3(file["path"], s3_key)
+    except HTTPException as e:
+        error = e.detail
     except Exception as e:
-        return f"An error occurred: {str(e)}"
-
-def extract_text_from_docx(file_content: bytes) -> str:
-    doc = Document(BytesIO(file_content))
-    text = "\n".join([para.text for para in doc.paragraphs])
-    return text
-
-def clean_symbols(text):
-  return re.sub(r'[^a-záéíóúA-Z0-9\s]', '', text)
+        error = str(e)
+    return {
+        "name": file["name"],
+        "filename": file.get("filename"),
+        "url": url,
+        "seconds": round(time.perf_counter() - start, 3),
+        "error": error,
+    }
 
 
 def upload_batch(
     batch: List[dict],
     company_name: str,  # Add company_name as a parameter
-):
-    urls = {}
-    try:
-        # Upload files to S3
-        for file in batch:
-            file_name = file["name"]
-            # Upload file to S3
-            s3_key = f"{company_name}/cvs/{file_name}"
-            urls[file_name] = upload_to_s3(file["file"], s3_key)
-    except Exception as e:
-        print(f"Error processing batch: {str(e)}")
-        raise e
-    return urls
+) -> List[dict]:
+    """
+    Upload a batch of spooled files to S3 with bounded concurrency.
+    Returns one report per file, in the same order as the batch.
+    Blocking, callers on the event loop should run it in an executor.
+    """
+    futures = [
+        s3_upload_executor.submit(upload_file_timed, file,
+                                  f"{company_name}/cvs/{file['name']}")
+        for file in batch
+    ]
+    uploads = [future.result() for future in futures]
+    for upload in uploads:
+        if upload["error"] is not None:
+            print(f"Error uploading {upload['name']}: {upload['error']}")
+    return uploads
 
 
 def process_file_text(
     batch: List[dict],
     companyId: int,
-    company_name: str,  # Add company_name as a parameter
-    db: Session,
     urls: dict,
         skills_list, city_offer, age_offer, genre_offer, experience_offer,
-        offerId):
-    cv_texts = []
-    temp_cvitae_records = []
-    try:
-        # Extract text from each CV, and save temporary CVitae records
-        for file in batch:
-            file_extension = file["extension"]
+        offerId, offer_text="", report=None):
+    """
+    Extract, score and store a batch of CVs uploaded to S3, through a
+    staged pipeline that works on chunks of PIPELINE_CHUNK_SIZE files:
+    fetch (local spool or S3) -> extract -> pre-filter -> score -> persist.
+    Each stage has its own workers, DB sessions and a bounded queue, so a
+    slow LLM response doesn't stop the extraction of the next chunks and OCR
+    heavy chunks don't leave the LLM idle, while backpressure keeps the
+    extracted texts waiting for the LLM bounded.
+    Pre-ranking compares the CVs of the whole batch, so with it enabled all
+    the files are extracted first, screened together, and only then scored
+    and persisted in chunks.
+    `report(file_name, status, error=None, done=False)`, when given, is
+    called as each file goes through the pipeline.
+    """
+    report = report or (lambda *args, **kwargs: None)
+    failures = []
+    errors = []
+
+    def fail(file_name, error, delete=True):
+        if delete:
+            delete_from_s3(urls[file_name])
+        report(file_name, "failed", error, done=True)
+        failures.append(file_name)
+
+    def fetch(files):
+        restored = restore_spooled_files(files, urls)
+        fetched = {file["name"] for file in restored}
+        for file in files:
+            if file["name"] not in fetched:
+                fail(file["name"], "Could not be downloaded", delete=False)
+        return {"files": restored} if restored else None
+
+    def extract(chunk):
+        # Files removed from the spool since they were fetched are downloaded
+        # again, the S3 copy is the only one left and must not be deleted
+        files = restore_spooled_files(chunk["files"], urls)
+        restored = {file["name"] for file in files}
+        for file in chunk["files"]:
+            if file["name"] not in restored:
+                fail(file["name"], "Could not be downloaded", delete=False)
+        chunk["files"] = files
+        try:
+            # Extract the text of every CV, from the cache when possible
+            with SessionLocal() as stage_db:
+                extracted = extract_with_cache(stage_db, files)
+        finally:
+            release_spooled_files(files)
+
+        chunk.update(names=[], cv_texts=[], records=[])
+        for file, result in zip(files, extracted):
             file_name = file["name"]
+            if isinstance(result, Exception):
+                # Skip the CV but keep processing the rest of the chunk
+                print(f"Error extracting text from {file_name}: {str(result)}")
+                fail(file_name, f"Text extraction failed: {str(result)}")
+                continue
+            chunk["names"].append(file_name)
+            chunk["cv_texts"].append(result["text"])
+            # Create a temporary CVitae record with the S3 URL
+            chunk["records"].append(CVitae(
+                url=urls[file_name],
+                size=file["size"],
+                content_hash=file["content_hash"],
+                companyId=companyId,
+                extension=file["extension"],
+                cvtext=result["text"],
+            ))
+            report(file_name, "extracted")
+        return chunk if chunk["records"] else None
+
+    def screen(chunk):
+        chunk["screened"] = screen_cv_texts(chunk["cv_texts"], skills_list, city_offer, age_offer,
+                                            genre_offer, experience_offer, offer_text)
+        return chunk
+
+    def score(chunk):
+        # Score the CVs, from the cache or packed into concurrent LLM requests
+        chunk["candidates"] = asyncio.run(score_screened_cv_texts(
+            chunk["cv_texts"], chunk["screened"], skills_list, city_offer, age_offer,
+            genre_offer, experience_offer))
+        for file_name, candidate_data in zip(chunk["names"], chunk["candidates"]):
+            if not isinstance(candidate_data, Exception):
+                report(file_name, "scored")
+        return chunk
+
+    def persist(chunk):
+        # A chunk that can't be committed is left to on_error, its S3 files are kept
+        with SessionLocal() as stage_db:
+            failed = analyze_and_update_vitae_offers(stage_db, offerId, chunk["records"],
+                                                     chunk["candidates"])
+        for file_name, record, candidate_data in zip(chunk["names"], chunk["records"],
+                                                     chunk["candidates"]):
+            if isinstance(candidate_data, Exception):
+                report(file_name, "failed", f"Scoring failed: {str(candidate_data)}", done=True)
+                failures.append(file_name)
+            elif any(record is failed_record for failed_record in failed):
+                report(file_name, "failed", "Could not be saved", done=True)
+                failures.append(file_name)
+            else:
+                report(file_name, "persisted", done=True)
+        return None
+
+    def on_error(stage_name, chunk, error):
+        # Unexpected errors leave the S3 files in place, a retry can pick them up
+        if isinstance(chunk, list):
+            names = [file["name"] for file in chunk]
+        else:
+            names = chunk.get("names") or [file["name"] for file in chunk["files"]]
+        for file_name in names:
+            report(file_name, "failed", f"{stage_name} failed: {str(error)}", done=True)
+        errors.append(error)
+
+    extract_stages = [
+        Stage("fetch", fetch, PIPELINE_FETCH_WORKERS),
+        Stage("extract", extract, PIPELINE_EXTRACT_WORKERS),
+    ]
+    score_stages = [
+        Stage("score", score, PIPELINE_SCORE_WORKERS),
+        Stage("persist", persist, PIPELINE_PERSIST_WORKERS),
+    ]
+    chunks = (batch[start:start + PIPELINE_CHUNK_SIZE]
+              for start in range(0, len(batch), PIPELINE_CHUNK_SIZE))
+    if not PRERANK_ENABLED:
+        StagedPipeline(extract_stages + [Stage("prefilter", screen, PIPELINE_PREFILTER_WORKERS)]
+                       + score_stages, on_error=on_error).run(chunks)
+    else:
+        extracted = StagedPipeline(extract_stages, on_error=on_error).run(chunks)
+        names = [name for chunk in extracted for name in chunk["names"]]
+        cv_texts = [text for chunk in extracted for text in chunk["cv_texts"]]
+        records = [record for chunk in extracted for record in chunk["records"]]
+        screened = screen_cv_texts(cv_texts, skills_list, city_offer, age_offer,
+                                   genre_offer, experience_offer, offer_text)
+        StagedPipeline(score_stages, on_error=on_error).run(
+            {"names": names[start:end], "cv_texts": cv_texts[start:end],
+             "records": records[start:end], "screened": slice_screened(screened, start, end)}
+            for start, end in ((start, start + PIPELINE_CHUNK_SIZE)
+                               for start in range(0, len(cv_texts), PIPELINE_CHUNK_SIZE)))
+
+    if errors:
+        raise Exception(f"Error processing batch: {len(errors)} chunks failed: {str(errors[0])}")
+    if len(failures) == len(batch):
+        raise HTTPException(status_code=400, detail="No CV of the batch could be processed")
+    if failures:
+        raise HTTPException(status_code=400, detail=f"Error processing texts: {len(failures)} of {len(batch)} CVs could not be processed")
+
+
+def candidate_id(idx: int) -> str:
+    """
+    Identifier of the idx-th CV of a job, echoed back by the LLM in `candidato_id`.
+    """
+    return f"CV-{idx + 1}"
 
-            # Read the file content and reset pointer
-            file_content = file["content"]
 
-            # Extract text based on file type
-            if file_extension == 'pdf':
-                cv_text = extract_text_from_pdf(file_content)
-            elif file_extension in ['docx', 'doc']:
-                cv_text = extract_text_from_docx(file_content)
-            else:
-                raise HTTPException(status_code=400, detail=f"Unsupported file format: {file_extension}")
+def format_cv_texts(cv_items: List[tuple]) -> str:
+    """
+    Compact each CV to its token budget and lay them out for the profile
+    prompt under their candidate identifier. `cv_items` holds (candidate_id, text).
+    """
+    return "\n\n".join(
+        f"### {item_id} ###\n{compact_cv_text(cv_text)}"
+        for item_id, cv_text in cv_items)
 
-            cv_texts.append(f"### Candidate #{len(cv_texts) + 1} ###\n{cv_text}")
 
-            # Create a temporary CVitae record with the S3 URL
-            temp_cvitae = CVitae(
-                url=urls[file_name],
-                companyId=companyId,
-                extension=file_extension,
-                cvtext=cv_text,
-            )
-            temp_cvitae_records.append(temp_cvitae)
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        print(f"Error processing batch: {str(e)}")
-        raise e
-    try:
-        analyze_and_update_vitae_offers(cv_texts, skills_list, city_offer,
-                                        age_offer, genre_offer,
-                                        experience_offer, db, offerId,
-                                        temp_cvitae_records)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error processing texts: {str(e)}")
+def format_profiles(profile_items: List[tuple]) -> str:
+    """
+    Lay out candidate profiles for the scoring prompt under their candidate
+    identifier, with the offer skills found in their CV.
+    `profile_items` holds (candidate_id, profile, matched skills).
+    """
+    return "\n\n".join(
+        f"### {item_id} ###\n"
+        f"Perfil: {json.dumps(profile, ensure_ascii=False)}\n"
+        f"Habilidades detectadas: {', '.join(matched_skills) or 'ninguna'}"
+        for item_id, profile, matched_skills in profile_items)
 
 
-def parse_prompt(
-        cv_texts: List[str],
+def build_profile_prompt(cv_items: List[tuple]) -> str:
+    return profile_prompt.format(cv_texts=format_cv_texts(cv_items))
+
+
+def build_prompt(
+        profile_items: List[tuple],
         skills_list: List[str],
         city_offer: str,
         age_offer: str,
         genre_offer: str,
         experience_offer: int,
-):
+) -> str:
     skills_list_str = ", ".join(skills_list)
-    full_prompt = prompt.format(city_offer=city_offer, age_offer=age_offer,
-                                genre_offer=genre_offer,
-                                experience_offer=experience_offer,
-                                skills_list_str=skills_list_str,
-                                cv_texts=cv_texts)
-
+    # Enum values are told as the limits the pre-filter and routing apply
+    return prompt.format(city_offer=city_offer, age_offer=age_offer or "Indiferente",
+                         genre_offer=gender_requirement(genre_offer),
+                         experience_offer=experience_requirement(experience_offer),
+                         skills_list_str=skills_list_str,
+                         candidates=format_profiles(profile_items))
+
+
+async def parse_prompt_async(
+        client: openai.AsyncOpenAI,
+        full_prompt: str,
+        response_format,
+        route: ModelRoute,
+):
+    """
+    Send a prompt to the model of a route, or to its fallback model while
+    that one is rate limited.
+    Returns the parsed response and the usage of the request (model, seconds
+    and tokens), or (None, None) when it fails.
+    """
     # Send the request to GPT
     messages = [
         {"role": "system", "content": "You are a helpful assistant."},
         {"role": "user", "content": full_prompt}
     ]
-    raw_response = None
     response_json = None
+    usage = None
+    # OpenAI reserves max_tokens of the quota for the completion
+    estimated_tokens = count_tokens(full_prompt) + LLM_MAX_OUTPUT_TOKENS
+
+    async def try_to_query(messages):
+        model = route.model
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            rate_limiter = model_router.rate_limiter(model)
+            await rate_limiter.acquire(estimated_tokens)
+            started = time.monotonic()
+            try:
+                # The reply is constrained to, and validated against, response_format
+                raw = await client.beta.chat.completions.with_raw_response.parse(
+                    model=model,
+                    messages=messages,
+                    temperature=0,
+                    max_tokens=LLM_MAX_OUTPUT_TOKENS,
+                    response_format=response_format
+                )
+            except openai.RateLimitError as e:
+                if attempt == LLM_MAX_RETRIES:
+                    raise
+                delay = retry_after(e.response.headers) or backoff_delay(attempt)
+                # Every worker holds off this model, not only this one
+                await rate_limiter.report(e.response.headers, pause=delay)
+                if route.fallback and model != route.fallback:
+                    print(f"RateLimit hit on {model}. Falling back to {route.fallback}...")
+                    model = route.fallback
+                    continue
+                print(f"RateLimit hit. Retrying in {delay:.1f} seconds...")
+                await asyncio.sleep(delay)
+                continue
+            except (openai.APIConnectionError, openai.InternalServerError):
+                if attempt == LLM_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            await rate_limiter.report(raw.headers)
+            completion = raw.parse()
+            message = completion.choices[0].message
+            if message.parsed is None:
+                print(f"Request refused by the model: {message.refusal}")
+                return None, None
+            return message.parsed.model_dump(), {
+                "route": route.name,
+                "model": model,
+                "latency": time.monotonic() - started,
+                "tokens": completion.usage.total_tokens if completion.usage else None,
+            }
+        return None, None
 
     try:
-        def try_to_query(messages):
-            global raw_response, response_json
-            response = openai.chat.completions.create(
-                model="gpt-4-turbo",
-                messages=messages,
-                temperature=0
-            )
-            raw_response = response.choices[0].message.content.strip()
-            response_json = extract_json(raw_response)
-            return response_json
-
-        response_json = try_to_query(messages)
-    except openai.RateLimitError:
-        print("RateLimit hit. Retrying in 5 seconds...")
-        time.sleep(5)
-        response_json = try_to_query(messages)
+        response_json, usage = await try_to_query(messages)
     except OpenAIError as e:
         print(f"Invalid Request Error: {e}")
-        print(f"Response Body: {e.response.json()}")  # Log the body
-    except json.JSONDecodeError:
-        print("JSON Decoding error. Retrying in 5 seconds...")
-        time.sleep(5)
-        response_json = try_to_query(messages)
+        if getattr(e, "response", None) is not None:
+            print(f"Response Body: {e.response.text}")  # Log the body
+    except ValidationError as e:
+        print(f"Response does not match the {response_format.__name__} schema: {e}")
     except Exception as e:
         print(f"Unhandled Error: {e}")
 
-    return response_json
+    return response_json, usage
 
 
-def analyze_and_update_vitae_offers(
-    cv_texts: List[str],
-    skills_list: List[str],
-    city_offer: str,
-    age_offer: str,
-    genre_offer: str,
-    experience_offer: int,
-    db: Session,
-    offerId: int,
-    cvitae_records: List[CVitae]
-):
-    try:
-        response_json = parse_prompt(cv_texts, skills_list,
-                                     city_offer, age_offer,
-                                     genre_offer, experience_offer)
-        if response_json is None:
-            print("Error processing the OpenAI response")
-            raise Exception("Error processing the OpenAI response")
+async def query_batches(prompts: List[str], response_format, route: ModelRoute) -> list:
+    """
+    Send the prompts, at most LLM_CONCURRENCY at a time. Returns the parsed
+    response and usage of each prompt, in order, or the exception that made
+    it fail.
+    """
+    semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
 
-        candidates = response_json.get("candidatos", [])
-        valid_cvitae = []
+    # The client is bound to the running event loop, so it is not shared
+    # Retries are handled by parse_prompt_async with the shared rate limiters
+    async with openai.AsyncOpenAI(api_key=os.getenv("OAI_KEY"), max_retries=0) as client:
+        async def query(full_prompt):
+            async with semaphore:
+                return await parse_prompt_async(client, full_prompt, response_format, route)
 
-        # Process each candidate
-        for idx, (temp_cvitae, candidate_data) in enumerate(zip(cvitae_records, candidates)):
-            # Use fallback values for missing fields
-            candidate_name = candidate_data.get("nombre", "name not found")
+        return await asyncio.gather(*[query(full_prompt) for full_prompt in prompts],
+                                    return_exceptions=True)
 
-            candidate_email = candidate_data.get("correo", "email not found")
 
-            # Create CVitae record with valid data
-            temp_cvitae.candidate_name = candidate_name
-            temp_cvitae.candidate_mail = candidate_email
-            temp_cvitae.candidate_dni = candidate_data.get("cedula")
-            temp_cvitae.candidate_dni_type = candidate_data.get("tipo_documento")
-            temp_cvitae.candidate_city = candidate_data.get("ciudad")
-            temp_cvitae.candidate_phone = candidate_data.get("movil")
+async def query_candidates(items: dict, format_items, build, response_format, route: ModelRoute):
+    """
+    Ask the LLM about many CVs, packed into concurrent requests that fit the
+    token limits. `items` maps each CV index to the values it is prompted
+    with, `build` makes the prompt of a list of (candidate_id, *values)
+    entries and `format_items` the part of it those entries take.
+    Results are matched to CVs by the candidate identifier in the prompt.
+    CVs missing from a response, or whose batch failed, are retried on their
+    own up to LLM_CANDIDATE_RETRIES times.
+    Returns the result of each CV index, or the exception that made it fail,
+    and the usage of the request that answered each CV, with the tokens split
+    between the CVs of the request.
+    """
+    def entry(idx):
+        return (candidate_id(idx),) + tuple(items[idx])
+
+    results = {}
+    usages = {}
+    pending = list(items)
+    for attempt in range(LLM_CANDIDATE_RETRIES + 1):
+        if not pending:
+            break
+        if attempt == 0:
+            prompt_tokens = count_tokens(build([]))
+            token_counts = [count_tokens(format_items([entry(idx)])) for idx in pending]
+            batches = [[pending[i] for i in indexes]
+                       for indexes in plan_batches(token_counts, prompt_tokens)]
+            # Batches holding the first items, e.g. the most relevant CVs, are sent first
+            position = {idx: pos for pos, idx in enumerate(pending)}
+            batches.sort(key=lambda batch: min(position[idx] for idx in batch))
+        else:
+            # Requeue the CVs left without a valid result one by one
+            print(f"Retrying {len(pending)} CVs missing from the LLM responses")
+            batches = [[idx] for idx in pending]
+
+        responses = await query_batches(
+            [build([entry(idx) for idx in indexes]) for indexes in batches],
+            response_format, route)
+
+        pending = []
+        for indexes, response in zip(batches, responses):
+            response_json, usage = response if isinstance(response, tuple) else (None, None)
+            by_id = {}
+            if isinstance(response_json, dict):
+                for candidate_data in response_json.get("candidatos", []):
+                    by_id.setdefault(candidate_data.get("candidato_id"), candidate_data)
+            for idx in indexes:
+                candidate_data = by_id.get(candidate_id(idx))
+                if candidate_data is None:
+                    pending.append(idx)
+                    continue
+                # The identifier only means something inside this job
+                results[idx] = {key: value for key, value in candidate_data.items()
+                                if key != "candidato_id"}
+                usages[idx] = dict(usage, tokens=usage["tokens"] / len(indexes)
+                                   if usage["tokens"] is not None else None)
+
+    for idx in pending:
+        results[idx] = Exception(f"No valid result for CV #{idx + 1} from the LLM")
+    return results, usages
+
+
+def profile_key(cv_text: str) -> str:
+    """
+    Hash of everything that determines a candidate's profile: the CV text
+    as prompted, the profile prompt version and the model.
+    """
+    key = json.dumps([compact_cv_text(cv_text or ""), PROFILE_PROMPT_VERSION,
+                      model_router.route("profile").model], ensure_ascii=False)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def get_stored_profiles(profile_keys: List[str]) -> dict:
+    with SessionLocal() as db:
+        return {
+            entry.profile_key: json.loads(entry.profile)
+            for entry in db.query(CandidateProfile).filter(CandidateProfile.profile_key.in_(profile_keys)).all()
+        }
+
+
+def store_profiles(profiles: dict):
+    with SessionLocal() as db:
+        for key, (profile, model) in profiles.items():
+            db.execute(insert(CandidateProfile).values(
+                profile_key=key,
+                model=model,
+                prompt_version=PROFILE_PROMPT_VERSION,
+                profile=json.dumps(profile),
+            ).on_conflict_do_nothing())
+        db.commit()
 
-            db.add(temp_cvitae)
-            db.flush()  # Save the record to get an ID
 
-            raw_score = candidate_data.get("score")
+async def get_candidate_profiles(cv_texts: List[str]) -> list:
+    """
+    Offer independent profile of each CV (contact data, age, experience...).
+    It is extracted by the LLM the first time a CV text is seen and stored,
+    every later offer the CV is scored for reuses it.
+    Returns the profile of each CV, in order, or the exception that made it fail.
+    """
+    loop = asyncio.get_event_loop()
+    keys = [profile_key(cv_text) for cv_text in cv_texts]
+    try:
+        stored = await loop.run_in_executor(None, get_stored_profiles, list(set(keys)))
+    except Exception as e:
+        print(f"Candidate profiles unavailable: {str(e)}")
+        stored = {}
+
+    profiles = [stored.get(key) for key in keys]
+    missing = {idx: (cv_text,) for idx, cv_text in enumerate(cv_texts) if profiles[idx] is None}
+    if missing:
+        extracted, usages = await query_candidates(missing, format_cv_texts, build_profile_prompt,
+                                                   CandidateProfilesResponseDTO,
+                                                   model_router.route("profile"))
+        new_profiles = {}
+        for idx, profile in extracted.items():
+            profiles[idx] = profile
+            if not isinstance(profile, Exception):
+                new_profiles[keys[idx]] = (profile, usages[idx]["model"])
+        if new_profiles:
             try:
-                score = float(raw_score)
-            except (ValueError, TypeError):
-                score = 0.0
-
-
-            # Create VitaeOffer record
-            vitae_offer = VitaeOffer(
-                cvitaeId=temp_cvitae.Id,
-                offerId=offerId,
-                status="pending",
-                ai_response=json.dumps(candidate_data),
-                response_score=score,
-            )
-            db.add(vitae_offer)
+                await loop.run_in_executor(None, store_profiles, new_profiles)
+            except Exception as e:
+                print(f"Could not store candidate profiles: {str(e)}")
+    return profiles
 
-            valid_cvitae.append(temp_cvitae)
 
+def scoring_cache_key(
+        cv_text: str,
+        skills_list: List[str],
+        city_offer: str,
+        age_offer: str,
+        genre_offer: str,
+        experience_offer: int,
+) -> str:
+    """
+    Hash of everything that determines a candidate's result: the CV text as
+    prompted, the offer criteria, the prompt versions and the models.
+    """
+    key = json.dumps([
+        compact_cv_text(cv_text or ""),
+        sorted(skills_list), city_offer, age_offer, genre_offer, experience_offer,
+        PROMPT_VERSION, PROFILE_PROMPT_VERSION,
+        [route.model for route in model_router.routes.values()],
+    ], default=str, ensure_ascii=False)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def get_cached_scores(cache_keys: List[str]) -> dict:
+    with SessionLocal() as db:
+        return {
+            entry.cache_key: json.loads(entry.response)
+            for entry in db.query(ScoringCache).filter(ScoringCache.cache_key.in_(cache_keys)).all()
+        }
+
+
+def store_cached_scores(scores: dict):
+    with SessionLocal() as db:
+        for cache_key, (candidate_data, model) in scores.items():
+            db.execute(insert(ScoringCache).values(
+                cache_key=cache_key,
+                model=model,
+                prompt_version=PROMPT_VERSION,
+                response=json.dumps(candidate_data),
+            ).on_conflict_do_nothing())
         db.commit()
 
+
+def screen_cv_texts(
+        cv_texts: List[str],
+        skills_list: List[str],
+        city_offer: str,
+        age_offer: str,
+        genre_offer: str,
+        experience_offer: int,
+        offer_text: str = "",
+        prerank: bool = True,
+) -> dict:
+    """
+    Local part of scoring CV texts, no LLM involved: matches the offer skills
+    in each CV, runs the pre-filter, serves CVs from the scoring cache and
+    pre-ranks the rest when enabled, unless `prerank` is False.
+    Returns the state `score_screened_cv_texts` carries on from, with the
+    indexes of the CVs still "pending" for the LLM.
+    """
+    matched_skills = SkillMatcher(skills_list).match_many(cv_texts)
+    results = [None] * len(cv_texts)
+    # How each result was obtained, stored with its VitaeOffer
+    routes = [None] * len(cv_texts)
+    if PREFILTER_ENABLED:
+        for idx, cv_text in enumerate(cv_texts):
+            reasons = prefilter_cv(cv_text, city_offer, age_offer, genre_offer, experience_offer)
+            if reasons:
+                results[idx] = rejected_candidate(cv_text, reasons)
+                routes[idx] = {"route": "prefilter"}
+        print(f"Pre-filter discarded {sum(result is not None for result in results)} of {len(cv_texts)} CVs")
+
+    cache_keys = [scoring_cache_key(cv_text, skills_list, city_offer, age_offer,
+                                    genre_offer, experience_offer)
+                  for cv_text in cv_texts]
+    try:
+        cached = get_cached_scores(
+            list({cache_keys[idx] for idx, result in enumerate(results) if result is None}))
+    except Exception as e:
+        print(f"Scoring cache unavailable: {str(e)}")
+        cached = {}
+
+    for idx, cache_key in enumerate(cache_keys):
+        if results[idx] is None and cache_key in cached:
+            results[idx] = cached[cache_key]
+            routes[idx] = {"route": "cache"}
+    pending = [idx for idx, result in enumerate(results) if result is None]
+    relevance = None
+    if PRERANK_ENABLED and prerank and pending:
+        relevance = relevance_scores(cv_texts, " ".join([offer_text or ""] + list(skills_list)))
+        relevant = [pending[i] for i in select_relevant(relevance[pending])]
+        for idx in set(pending) - set(relevant):
+            results[idx] = local_candidate(cv_texts[idx], "Sin evaluar")
+            routes[idx] = {"route": "prerank"}
+        print(f"Pre-ranking kept {len(relevant)} of {len(pending)} CVs for the LLM")
+        pending = relevant
+    return {
+        "matched_skills": matched_skills,
+        "results": results,
+        "routes": routes,
+        "cache_keys": cache_keys,
+        "pending": pending,
+        "relevance": relevance,
+    }
+
+
+def slice_screened(screened: dict, start: int, end: int) -> dict:
+    """
+    State of `screen_cv_texts` for the CVs start:end, to score them apart.
+    """
+    return {
+        "matched_skills": screened["matched_skills"][start:end],
+        "results": screened["results"][start:end],
+        "routes": screened["routes"][start:end],
+        "cache_keys": screened["cache_keys"][start:end],
+        "pending": [idx - start for idx in screened["pending"] if start <= idx < end],
+        "relevance": screened["relevance"][start:end] if screened["relevance"] is not None else None,
+    }
+
+
+async def score_screened_cv_texts(
+        cv_texts: List[str],
+        screened: dict,
+        skills_list: List[str],
+        city_offer: str,
+        age_offer: str,
+        genre_offer: str,
+        experience_offer: int,
+) -> list:
+    """
+    LLM part of scoring CV texts, for the CVs `screen_cv_texts` left pending.
+    Returns the candidate data of each CV, in order, or the exception that
+    made it fail.
+    """
+    loop = asyncio.get_event_loop()
+    matched_skills = screened["matched_skills"]
+    results = list(screened["results"])
+    routes = list(screened["routes"])
+    cache_keys = screened["cache_keys"]
+    pending = screened["pending"]
+    relevance = screened["relevance"]
+    scores = {}
+    if pending:
+        profile_items = {}
+        profiles = await get_candidate_profiles([cv_texts[idx] for idx in pending])
+        for idx, profile in zip(pending, profiles):
+            if isinstance(profile, Exception):
+                results[idx] = profile
+            else:
+                profile_items[idx] = (profile, matched_skills[idx])
+
+        def build(entries):
+            return build_prompt(entries, skills_list, city_offer, age_offer,
+                                genre_offer, experience_offer)
+
+        # Clear profiles go to the cheap model, borderline ones to the strong model
+        borderline = {idx for idx, (profile, _) in profile_items.items()
+                      if is_borderline_profile(profile, city_offer, age_offer,
+                                               genre_offer, experience_offer)}
+        routed = await asyncio.gather(
+            query_candidates({idx: item for idx, item in profile_items.items() if idx not in borderline},
+                             format_profiles, build, CandidatesResponseDTO,
+                             model_router.route("scoring")),
+            query_candidates({idx: item for idx, item in profile_items.items() if idx in borderline},
+                             format_profiles, build, CandidatesResponseDTO,
+                             model_router.route("borderline")),
+        )
+        for statuses, usages in routed:
+            for idx, status in statuses.items():
+                if isinstance(status, Exception):
+                    results[idx] = status
+                    continue
+                candidate_data = dict(profile_items[idx][0], **status)
+                results[idx] = candidate_data
+                routes[idx] = usages[idx]
+                scores[cache_keys[idx]] = (candidate_data, usages[idx]["model"])
+
+    for idx, result in enumerate(results):
+        if isinstance(result, dict):
+            # Skill matching is deterministic, it overrides the LLM's own list
+            results[idx] = dict(result, habilidades_encontradas=matched_skills[idx],
+                                habilidades_solicitadas=list(skills_list))
+            if relevance is not None:
+                results[idx]["relevancia"] = round(float(relevance[idx]), 4)
+            results[idx]["ruta"] = routes[idx]
+
+    # The LLM only extracts features, the score is computed here for all CVs at once
+    scored = [idx for idx, result in enumerate(results) if isinstance(result, dict)]
+    for idx, score in zip(scored, candidate_scores([results[idx] for idx in scored])):
+        results[idx]["score"] = score
+
+    if scores:
+        try:
+            await loop.run_in_executor(None, store_cached_scores, scores)
+        except Exception as e:
+            print(f"Could not store scores in the cache: {str(e)}")
+    return results
+
+
+async def score_cv_texts(
+        cv_texts: List[str],
+        skills_list: List[str],
+        city_offer: str,
+        age_offer: str,
+        genre_offer: str,
+        experience_offer: int,
+        offer_text: str = "",
+        prerank: bool = True,
+) -> list:
+    """
+    Score CV texts for an offer. CVs already scored with the same text,
+    criteria, prompts and models are served from the scoring cache.
+    The rest get their stored candidate profile, extracted once per CV, and
+    only the profiles are sent to the LLM to be checked against the offer.
+    CVs that clearly miss the mandatory offer criteria are marked "No apto"
+    by the pre-filter without calling the LLM.
+    The offer skills found in each CV are matched locally, sent along with
+    it and returned as its "habilidades_encontradas".
+    The score is the HET score of the extracted features.
+    Profiles that are incomplete or close to the offer limits are checked by
+    the strong model, the rest by the cheap one. How each result was obtained
+    is returned under "ruta".
+    With the pre-ranking enabled, CVs are sent to the LLM most relevant to
+    `offer_text` and the skills first, and those outside the top-K or under
+    the similarity threshold are left "Sin evaluar" to be scored later, by
+    reprocessing them with `prerank` False.
+    Returns the candidate data of each CV, in order, or the exception that
+    made it fail.
+    """
+    loop = asyncio.get_event_loop()
+    screened = await loop.run_in_executor(
+        None, screen_cv_texts, cv_texts, skills_list, city_offer, age_offer,
+        genre_offer, experience_offer, offer_text, prerank)
+    return await score_screened_cv_texts(cv_texts, screened, skills_list, city_offer,
+                                         age_offer, genre_offer, experience_offer)
+
+
+def route_columns(candidate_data: dict) -> dict:
+    """
+    VitaeOffer columns recording how a candidate result was obtained
+    (model route, model, request seconds and its share of tokens).
+    """
+    route = candidate_data.get("ruta") or {}
+    tokens = route.get("tokens")
+    return {
+        "llm_route": route.get("route"),
+        "llm_model": route.get("model"),
+        "llm_latency": route.get("latency"),
+        "llm_tokens": round(tokens) if tokens is not None else None,
+    }
+
+
+def analyze_and_update_vitae_offers(
+    db: Session,
+    offerId: int,
+    cvitae_records: List[CVitae],
+    candidates: list
+) -> List[CVitae]:
+    """
+    Save the new CVitae records whose CV was scored, with their VitaeOffer.
+    `candidates` holds the candidate data of each record, or the exception
+    that made its scoring fail. Each record is saved in its own savepoint,
+    so one that can't be saved doesn't discard the rest. Records that failed
+    are not saved and their S3 files are deleted. Returns the records that
+    failed.
+    """
+    failed = []
+    # Process each candidate
+    for temp_cvitae, candidate_data in zip(cvitae_records, candidates):
+        if isinstance(candidate_data, Exception):
+            print(f"Error scoring {temp_cvitae.url}: {str(candidate_data)}")
+            failed.append(temp_cvitae)
+            continue
+
+        # Use fallback values for missing fields
+        candidate_name = candidate_data.get("nombre") or "name not found"
+
+        candidate_email = candidate_data.get("correo") or "email not found"
+
+        raw_score = candidate_data.get("score")
+        try:
+            score = float(raw_score)
+        except (ValueError, TypeError):
+            score = 0.0
+
+        try:
+            with db.begin_nested():
+                # Create CVitae record with valid data
+                temp_cvitae.candidate_name = candidate_name
+                temp_cvitae.candidate_mail = candidate_email
+                temp_cvitae.candidate_dni = candidate_data.get("cedula")
+                temp_cvitae.candidate_dni_type = candidate_data.get("tipo_documento")
+                temp_cvitae.candidate_city = candidate_data.get("ciudad")
+                temp_cvitae.candidate_phone = candidate_data.get("movil")
+
+                db.add(temp_cvitae)
+                db.flush()  # Save the record to get an ID
+
+                # Create VitaeOffer record
+                db.add(VitaeOffer(
+                    cvitaeId=temp_cvitae.Id,
+                    offerId=offerId,
+                    status="pending",
+                    ai_response=json.dumps(candidate_data),
+                    response_score=score,
+                    matched_skills=candidate_data.get("habilidades_encontradas"),
+                    **route_columns(candidate_data),
+                ))
+        except Exception as e:
+            print(f"Error creating CVitae/VitaeOffer records for {temp_cvitae.url}: {str(e)}")
+            failed.append(temp_cvitae)
+
+    try:
+        db.commit()
     except Exception as e:
-        # Rollback changes and delete S3 files for all temporary CVitae records
+        # Nothing was saved, the S3 files are kept so a retry of the job can store them
         db.rollback()
         print(f"Error analyzing and creating CVitae/VitaeOffer records: {str(e)}")
-        for temp_cvitae in cvitae_records:
-            delete_from_s3(temp_cvitae.url)  # Delete the file from S3
         raise HTTPException(status_code=500, detail="An error occurred while analyzing and creating records.")
 
+    # Only the CVs that could not be scored or saved are discarded
+    for temp_cvitae in failed:
+        delete_from_s3(temp_cvitae.url)
+    return failed
+
+
+def candidate_scores(candidates: List[dict], weights: tuple = HET_WEIGHTS) -> List[float]:
+    """
+    HET score of each candidate. CVs discarded by the pre-filter keep a
+    score of 0, so they never rank above the candidates that may fit.
+    """
+    # Records stored before routes were recorded only have the reasons
+    scored = [idx for idx, candidate_data in enumerate(candidates)
+              if (candidate_data.get("ruta") or {}).get("route") != "prefilter"
+              and "prefiltro" not in candidate_data]
+    scores = [0.0] * len(candidates)
+    for idx, score in zip(scored, het_scores([candidates[idx] for idx in scored], weights)):
+        scores[idx] = float(score)
+    return scores
+
+
+def rescore_offer(db: Session, offerId: int, weights: tuple = HET_WEIGHTS) -> int:
+    """
+    Recompute the HET score of every candidate of an offer from the features
+    stored in their VitaeOffer, without calling the LLM.
+    Returns the number of candidates rescored.
+    """
+    vitae_offers = []
+    candidates = []
+    for vitae_offer in db.query(VitaeOffer).filter(VitaeOffer.offerId == offerId,
+                                                   VitaeOffer.ai_response.isnot(None)):
+        try:
+            candidate_data = json.loads(vitae_offer.ai_response)
+        except ValueError:
+            continue
+        if isinstance(candidate_data, dict):
+            vitae_offers.append(vitae_offer)
+            candidates.append(candidate_data)
+
+    # Invalid weights raise ValueError before anything is changed
+    scores = candidate_scores(candidates, weights)
+    try:
+        for vitae_offer, candidate_data, score in zip(vitae_offers, candidates, scores):
+            candidate_data["score"] = score
+            vitae_offer.ai_response = json.dumps(candidate_data)
+            vitae_offer.response_score = score
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Error rescoring offer {offerId}: {str(e)}")
+        raise HTTPException(status_code=500, detail="An error occurred while rescoring the offer.")
+    return len(vitae_offers)
+
 
 def fetch_background_check_result(job_id: str, cvitae_id: int, db: Session, retry_interval: int = 10, max_retries: int = 10):
     """
@@ -427,67 +1377,79 @@ def get_token():
         raise HTTPException(status_code=500, detail=f"Failed to retrieve token: {str(e)}")
 
 
+def load_cvitae_records(db: Session, cvitae_ids: List[int], reextract: bool = False) -> List[CVitae]:
+    """
+    Fetch CVitae records in the order of `cvitae_ids`.
+    With `reextract`, texts are first brought up to the current extractor.
+    """
+    records = {cvitae.Id: cvitae for cvitae in db.query(CVitae).filter(CVitae.Id.in_(cvitae_ids)).all()}
+    if not records or len(records) != len(set(cvitae_ids)):
+        raise HTTPException(status_code=404, detail="One or more CVitae records not found.")
+    cvitae_records = [records[cvitae_id] for cvitae_id in cvitae_ids]
+
+    if reextract:
+        refresh_cvitae_texts(db, cvitae_records)
+    return cvitae_records
+
+
 def process_existing_vitae_records(
     cvitae_ids: List[int],
     offerId: int,
-    skills_list: List[str],
-    city_offer: str,
-    age_offer: str,
-    genre_offer: str,
-    experience_offer: int,
-    db: Session
-):
+    db: Session,
+    candidates: list
+) -> List[int]:
     """
-    Process existing CVitae records by their IDs and create/update associated VitaeOffer records.
+    Create/update the VitaeOffer records of existing CVitae records by their IDs.
+    `candidates` holds the candidate data of each ID, in the order of
+    `cvitae_ids`, or the exception that made its scoring fail.
+    Failed IDs are skipped and returned, the rest are saved.
     This does not delete CVitae records on failure.
     """
+    failed = []
     try:
-        # Fetch CVitae records
-        cvitae_records = db.query(CVitae).filter(CVitae.Id.in_(cvitae_ids)).all()
-        if not cvitae_records or len(cvitae_records) != len(cvitae_ids):
-            raise HTTPException(status_code=404, detail="One or more CVitae records not found.")
-
-        # Prepare cv_texts for GPT processing
-        cv_texts = [cv.cvtext for cv in cvitae_records]
-
-        response_json = parse_prompt(cv_texts, skills_list,
-                                     city_offer, age_offer,
-                                     genre_offer, experience_offer)
-        if response_json is None:
-            print("Error processing the OpenAI response")
-            raise Exception("Error processing the OpenAI response")
-
-        # Prepare the GPT prompt
-        candidates = response_json.get("candidatos", [])
-
         # Process each candidate
-        for idx, (cvitae, candidate_data) in enumerate(zip(cvitae_records,
-                                                           candidates)):
+        for cvitae_id, candidate_data in zip(cvitae_ids, candidates):
+            if isinstance(candidate_data, Exception):
+                print(f"Error scoring CVitae {cvitae_id}: {str(candidate_data)}")
+                failed.append(cvitae_id)
+                continue
             try:
+                raw_score = candidate_data.get("score")
+                try:
+                    score = float(raw_score)
+                except (ValueError, TypeError):
+                    score = 0.0
+
                 # Update/Create VitaeOffer record
                 vitae_offer = db.query(VitaeOffer).filter(
-                    VitaeOffer.cvitaeId == cvitae.Id,
+                    VitaeOffer.cvitaeId == cvitae_id,
                     VitaeOffer.offerId == offerId
                 ).first()
 
                 if vitae_offer:
                     # Update existing VitaeOffer
                     vitae_offer.ai_response = json.dumps(candidate_data)
-                    vitae_offer.response_score = candidate_data.get("score", 0)
+                    vitae_offer.response_score = score
+                    vitae_offer.matched_skills = candidate_data.get("habilidades_encontradas")
+                    for column, value in route_columns(candidate_data).items():
+                        setattr(vitae_offer, column, value)
                     vitae_offer.status = "pending"
                 else:
                     # Create new VitaeOffer
                     vitae_offer = VitaeOffer(
-                        cvitaeId=cvitae.Id,
+                        cvitaeId=cvitae_id,
                         offerId=offerId,
                         status="pending",
                         ai_response=json.dumps(candidate_data),
-                        response_score=candidate_data.get("score", 0),
+                        response_score=score,
+                        matched_skills=candidate_data.get("habilidades_encontradas"),
+                        **route_columns(candidate_data),
                     )
                     db.add(vitae_offer)
             except Exception as e:
                 print(traceback.format_exc())
-                print(f"Error processing: {str(cvitae)}\nError: {str(e)}")
+                print(f"Error processing: {cvitae_id}\nError: {str(e)}")
+                failed.append(cvitae_id)
 
         db.commit()
 
@@ -497,16 +1459,4 @@ def process_existing_vitae_records(
         db.rollback()
         print(f"Error processing existing CVitae records: {str(e)}")
         raise HTTPException(status_code=500, detail="An error occurred while processing CVitae records.")
-
-def extract_json(raw_response):
-    # Try to extract JSON block inside ```json ... ```
-    match = re.search(r"```json\s*(\{.*?\})\s*```", raw_response, re.DOTALL)
-    if match:
-        return json.loads(match.group(1))
-    else:
-        # Try to parse entire response as JSON (if it's just JSON)
-        try:
-            return json.loads(raw_response)
-        except json.JSONDecodeError:
-            print("Failed to parse JSON.")
-            return None
\ No newline at end of file
+    return failed
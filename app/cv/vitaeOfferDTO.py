@@ -1,6 +1,7 @@
 from datetime import date, datetime
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+from app.utils.het_score import HET_WEIGHTS
 
 class VitaeOfferResponseDTO(BaseModel):
     vitae_offer_id: int
@@ -14,6 +15,7 @@ class VitaeOfferResponseDTO(BaseModel):
     smartdataId: Optional[str]
     whatsapp_status: Optional[str]
     response_score: Optional[float]
+    matched_skills: Optional[List[str]] = None
     status: Optional[str]
     comments: Optional[str]
     created_date: Optional[datetime]
@@ -44,4 +46,35 @@ class CVitaeResponseDTO(BaseModel):
     associated_cargos: List[str]
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class HetWeightsDTO(BaseModel):
+    skills: float = Field(HET_WEIGHTS[0], ge=0)
+    experience: float = Field(HET_WEIGHTS[1], ge=0)
+    tenure: float = Field(HET_WEIGHTS[2], ge=0)
+
+# Structured output of the profile prompt, also sent to OpenAI as the response schema
+class CandidateProfileDTO(BaseModel):
+    candidato_id: str
+    nombre: Optional[str]
+    cedula: Optional[str]
+    tipo_documento: Optional[str]
+    ciudad: Optional[str]
+    genero: Optional[str]
+    movil: Optional[str]
+    correo: Optional[str]
+    experiencia_en_anos: Optional[float]
+    tiempo_promedio_en_cada_trabajo: Optional[float]
+    nivel_educativo: Optional[str]
+    edad: Optional[int]
+
+class CandidateProfilesResponseDTO(BaseModel):
+    candidatos: List[CandidateProfileDTO]
+
+# Structured output of the scoring prompt
+class CandidateDTO(BaseModel):
+    candidato_id: str
+    status: Literal["Apto", "No apto"]
+
+class CandidatesResponseDTO(BaseModel):
+    candidatos: List[CandidateDTO]
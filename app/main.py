@@ -14,6 +14,7 @@ from app.cv.cvController import cvRouter
 from app.cargo.cargoController import cargoRouter
 from app.skill.skillController import skillRouter
 from app.health.healthController import healthRouter
+from app.utils.job_queue import job_queue
 
 description = """
 All these configurations are suggested in the doc and
@@ -90,6 +91,15 @@ app.include_router(skillRouter)
 app.include_router(healthRouter)
 
 
+# Start the workers of the background job queue
+@app.on_event("startup")
+async def start_job_workers():
+    job_queue.start()
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    job_queue.stop()
+
 # Start profiling when the application starts
 @app.on_event("startup")
 async def start_profiling():
@@ -0,0 +1,41 @@
+import os
+from typing import List
+
+# Limits of a single scoring request to the LLM
+LLM_MAX_INPUT_TOKENS = int(os.getenv("LLM_MAX_INPUT_TOKENS", "24000"))
+LLM_MAX_OUTPUT_TOKENS = int(os.getenv("LLM_MAX_OUTPUT_TOKENS", "4096"))
+# Expected size of the JSON returned for one candidate
+LLM_OUTPUT_TOKENS_PER_CV = int(os.getenv("LLM_OUTPUT_TOKENS_PER_CV", "350"))
+LLM_MAX_CANDIDATES = int(os.getenv("LLM_MAX_CANDIDATES", "10"))
+
+
+def plan_batches(
+    token_counts: List[int],
+    prompt_tokens: int,
+    max_input_tokens: int = LLM_MAX_INPUT_TOKENS,
+    max_output_tokens: int = LLM_MAX_OUTPUT_TOKENS,
+    output_tokens_per_item: int = LLM_OUTPUT_TOKENS_PER_CV,
+    max_items: int = LLM_MAX_CANDIDATES,
+) -> List[List[int]]:
+    """
+    Pack items into as few LLM requests as possible (first fit decreasing).
+    `token_counts` holds the prompt tokens of each item and `prompt_tokens`
+    the fixed tokens of the prompt around them. Returns batches of item
+    indexes, each in ascending order. An item too large for any request is
+    placed on its own.
+    """
+    max_items = max(1, min(max_items, max_output_tokens // output_tokens_per_item))
+    input_budget = max_input_tokens - prompt_tokens
+
+    batches = []  # [used_tokens, [indexes]]
+    for idx in sorted(range(len(token_counts)), key=lambda i: token_counts[i], reverse=True):
+        tokens = token_counts[idx]
+        for batch in batches:
+            if len(batch[1]) < max_items and batch[0] + tokens <= input_budget:
+                batch[0] += tokens
+                batch[1].append(idx)
+                break
+        else:
+            batches.append([tokens, [idx]])
+
+    return sorted((sorted(indexes) for _, indexes in batches), key=lambda indexes: indexes[0])
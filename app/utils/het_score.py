@@ -0,0 +1,49 @@
+import os
+from typing import List, Tuple
+
+import numpy as np
+
+# Weights of H (skills), E (experience) and T (average tenure) in the score
+HET_WEIGHTS = (
+    float(os.getenv("HET_WEIGHT_SKILLS", "0.5")),
+    float(os.getenv("HET_WEIGHT_EXPERIENCE", "0.3")),
+    float(os.getenv("HET_WEIGHT_TENURE", "0.2")),
+)
+# Years of experience and months of average tenure worth a full 10
+HET_MAX_EXPERIENCE_YEARS = float(os.getenv("HET_MAX_EXPERIENCE_YEARS", "10"))
+HET_MAX_TENURE_MONTHS = float(os.getenv("HET_MAX_TENURE_MONTHS", "36"))
+
+
+def feature_array(candidates: List[dict], field: str) -> np.ndarray:
+    values = []
+    for candidate_data in candidates:
+        try:
+            values.append(float(candidate_data.get(field)))
+        except (ValueError, TypeError):
+            values.append(0.0)
+    return np.array(values, dtype=float)
+
+
+def het_scores(candidates: List[dict], weights: Tuple[float, float, float] = HET_WEIGHTS) -> np.ndarray:
+    """
+    HET score (0 to 10) of each candidate from the features extracted from
+    their CV: found and requested skills, years of experience and average
+    months in each job. Missing features count as 0.
+    """
+    if not candidates:
+        return np.zeros(0)
+    found = np.array([len(candidate_data.get("habilidades_encontradas") or [])
+                      for candidate_data in candidates], dtype=float)
+    requested = np.array([len(candidate_data.get("habilidades_solicitadas") or [])
+                          for candidate_data in candidates], dtype=float)
+    features = np.stack([
+        np.divide(found, requested, out=np.zeros_like(found), where=requested > 0),
+        feature_array(candidates, "experiencia_en_anos") / HET_MAX_EXPERIENCE_YEARS,
+        feature_array(candidates, "tiempo_promedio_en_cada_trabajo") / HET_MAX_TENURE_MONTHS,
+    ], axis=1)
+    features = np.clip(features, 0, 1) * 10
+
+    weights = np.array(weights, dtype=float)
+    if weights.sum() <= 0:
+        raise ValueError("HET weights must add up to more than 0")
+    return np.round(features @ (weights / weights.sum()), 2)
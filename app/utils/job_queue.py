@@ -0,0 +1,559 @@
+from datetime import timedelta
+from enum import Enum
+import asyncio
+import inspect
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from uuid import uuid4
+
+from sqlalchemy import and_, func, or_, update
+from sqlalchemy.orm import defer
+
+from db.session import SessionLocal
+from models.models import Job
+
+# Worker threads pulling jobs in each process, 0 for processes that only enqueue
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+# Seconds a claimed job stays leased without a heartbeat before others can claim it
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+# Seconds an idle worker waits before looking for jobs again
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+# Runs of a job, counting the first, before it is dead lettered
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Delay before a failed job is retried: base * 2^(attempt - 1) seconds, capped
+JOB_RETRY_BASE = 30
+JOB_RETRY_CAP = 30 * 60
+# Seconds between writes of a running job's progress
+JOB_PROGRESS_INTERVAL = float(os.getenv("JOB_PROGRESS_INTERVAL", "1"))
+# Tasks of an offer returned when listing them
+JOB_LIST_LIMIT = 100
+# Seconds changes are looked up again for, to catch rows committed out of order
+JOB_EVENTS_LAG = 5
+# Seconds between looks for changes of the jobs a client watches
+JOB_EVENTS_POLL_INTERVAL = float(os.getenv("JOB_EVENTS_POLL_INTERVAL", "1"))
+# Job states that won't change anymore
+JOB_FINAL_STATES = {"completed", "failed", "dead"}
+
+# Priority lanes, jobs in the priority lane are claimed before normal ones
+PRIORITY_LANE = 0
+NORMAL_LANE = 1
+# Seconds a normal job waits before it competes with the priority lane
+JOB_PRIORITY_AGING = int(os.getenv("JOB_PRIORITY_AGING", "600"))
+# Jobs a company, or an offer, can have running at once across all workers, 0 for no cap
+JOB_MAX_RUNNING_PER_COMPANY = int(os.getenv("JOB_MAX_RUNNING_PER_COMPANY", "2"))
+JOB_MAX_RUNNING_PER_OFFER = int(os.getenv("JOB_MAX_RUNNING_PER_OFFER", "0"))
+# Seconds of past work counted as the share a company already received
+JOB_FAIR_SHARE_WINDOW = int(os.getenv("JOB_FAIR_SHARE_WINDOW", "600"))
+
+
+def parse_weights(value: str) -> dict:
+    """
+    Parse company weights as "<company id>:<weight>" pairs separated by
+    commas, e.g. "12:3,40:0.5". Companies not listed weigh 1.
+    """
+    weights = {}
+    for pair in filter(None, (pair.strip() for pair in (value or "").split(","))):
+        company_id, weight = pair.split(":")
+        weights[int(company_id)] = float(weight)
+    return weights
+
+
+# Share of the workers each company gets relative to the others
+JOB_COMPANY_WEIGHTS = parse_weights(os.getenv("JOB_COMPANY_WEIGHTS", ""))
+
+
+class Status(Enum):
+    QUEUED = 1
+    PROCESSING = 2
+    COMPLETED = 3
+    FAILED = 4
+
+
+# Job states as reported by the task endpoints, dead jobs are failed ones
+# that won't be retried
+JOB_STATUS = {
+    "queued": Status.QUEUED,
+    "processing": Status.PROCESSING,
+    "completed": Status.COMPLETED,
+    "failed": Status.FAILED,
+    "dead": Status.FAILED,
+}
+
+
+class JobFailed(Exception):
+    """
+    Failure of a job that running it again won't fix, it is not retried.
+    """
+
+
+class JobProgress:
+    """
+    Progress of a running job: the result of each item it processes (files
+    or CVs) and how many are done. Kept in memory and written to the job
+    row at most every JOB_PROGRESS_INTERVAL seconds, so any worker can
+    report it.
+    """
+
+    def __init__(self, job_id, worker_id, results=None, total=None, interval=JOB_PROGRESS_INTERVAL):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.interval = interval
+        self.total = total
+        # Results recorded on enqueue or by earlier attempts, until reported again
+        self.results = dict(results or {})
+        self.done = set()
+        self.written_at = 0
+        self.lock = threading.Lock()
+
+    def set_total(self, total):
+        with self.lock:
+            self.total = total
+        self.flush()
+
+    def update(self, key, status, error=None, done=False):
+        """
+        Record the status of an item, `done` when it won't change anymore.
+        Other fields recorded on enqueue, e.g. the name of an uploaded file
+        on the client, are kept.
+        """
+        key = str(key)
+        with self.lock:
+            result = {field: value for field, value in self.results.get(key, {}).items()
+                      if field not in ("status", "error")}
+            result["status"] = status
+            if error:
+                result["error"] = error
+            self.results[key] = result
+            if done:
+                self.done.add(key)
+        if time.monotonic() - self.written_at >= self.interval:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            values = {"results": json.dumps(self.results), "processed": len(self.done),
+                      "total": self.total}
+            self.written_at = time.monotonic()
+        try:
+            with SessionLocal() as db:
+                db.execute(update(Job).where(
+                    Job.id == self.job_id, Job.lease_owner == self.worker_id
+                ).values(**values))
+                db.commit()
+        except Exception as e:
+            print(f"Could not save the progress of job {self.job_id}: {str(e)}")
+
+
+class FairShareScheduler:
+    """
+    Decides which runnable job a worker claims, so a company with a large
+    backlog doesn't hold up everybody else's small uploads:
+    - Jobs in the priority lane (small uploads and reprocess requests) go
+      first. Normal jobs join that lane after waiting JOB_PRIORITY_AGING
+      seconds, so they are not starved.
+    - Within a lane, the company that received the least work, in items
+      (files or CVs) of the jobs it ran in the last JOB_FAIR_SHARE_WINDOW
+      seconds divided by its weight, goes first. This is weighted fair
+      queuing over the companies. Between the offers of a company, the one
+      that received the least work goes first, so one offer's backlog
+      doesn't hold up the company's other offers.
+    - Companies and offers at their cap of running jobs are skipped. Caps
+      are checked before claiming, so concurrent claims can briefly go one
+      over them.
+    """
+
+    def __init__(self, weights=None, company_cap=JOB_MAX_RUNNING_PER_COMPANY,
+                 offer_cap=JOB_MAX_RUNNING_PER_OFFER, aging=JOB_PRIORITY_AGING):
+        self.weights = JOB_COMPANY_WEIGHTS if weights is None else weights
+        self.company_cap = company_cap
+        self.offer_cap = offer_cap
+        self.aging = timedelta(seconds=aging)
+
+    def weight(self, company_id) -> float:
+        return max(self.weights.get(company_id, 1.0), 0.001)
+
+    def order(self, candidates, running, service, now) -> list:
+        """
+        IDs of the candidate jobs in the order they should be claimed, the
+        ones that can't run now left out.
+        `candidates` are (id, company_id, offer_id, priority, run_after) of
+        the first runnable job of each offer, and `running` the running jobs
+        and `service` the items ran, by (company_id, offer_id).
+        """
+        running_companies = {}
+        for (company_id, offer_id), count in running.items():
+            running_companies[company_id] = running_companies.get(company_id, 0) + count
+        company_service = {}
+        for (company_id, offer_id), items in service.items():
+            company_service[company_id] = company_service.get(company_id, 0) + items
+
+        eligible = []
+        for job_id, company_id, offer_id, priority, run_after in candidates:
+            if company_id is not None and self.company_cap > 0 \
+                    and running_companies.get(company_id, 0) >= self.company_cap:
+                continue
+            if offer_id is not None and self.offer_cap > 0 \
+                    and running.get((company_id, offer_id), 0) >= self.offer_cap:
+                continue
+            lane = PRIORITY_LANE if priority == PRIORITY_LANE or now - run_after >= self.aging \
+                else NORMAL_LANE
+            share = company_service.get(company_id, 0) / self.weight(company_id)
+            offer_service = service.get((company_id, offer_id), 0)
+            eligible.append(((lane, share, offer_service, run_after), job_id))
+        return [job_id for _, job_id in sorted(eligible)]
+
+
+class JobQueue:
+    """
+    Durable queue of background jobs stored in the jobs table, so queued
+    work survives deploys and worker restarts, and every worker process on
+    every node pulls from it.
+    Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED and leased to a
+    worker, which renews the lease with heartbeats while the job runs. Jobs
+    whose lease expires, e.g. because their worker died, are claimed again.
+    Failed jobs are retried with exponential backoff up to their max
+    attempts, then marked dead.
+    """
+
+    def __init__(self, lease_seconds=JOB_LEASE_SECONDS, poll_interval=JOB_POLL_INTERVAL,
+                 scheduler=None):
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.scheduler = scheduler or FairShareScheduler()
+        self.handlers = {}
+        self.workers = []
+        self.stopping = threading.Event()
+        self.running = threading.local()
+
+    def handler(self, kind):
+        """
+        Register the function that runs the jobs of a kind. It is called
+        with the job payload as keyword arguments, coroutines are run in
+        their own event loop.
+        """
+        def register(func):
+            self.handlers[kind] = func
+            return func
+        return register
+
+    def enqueue(self, kind, payload, offer_id=None, company_id=None,
+                max_attempts=JOB_MAX_ATTEMPTS, results=None, priority=NORMAL_LANE) -> str:
+        """
+        Queue a job. `results` holds the initial status of the items it
+        processes, e.g. the files already uploaded. Jobs are scheduled
+        fairly between the companies and offers they belong to.
+        """
+        job_id = str(uuid4())
+        with SessionLocal() as db:
+            db.add(Job(
+                id=job_id,
+                kind=kind,
+                payload=json.dumps(payload),
+                status="queued",
+                offer_id=offer_id,
+                company_id=company_id,
+                max_attempts=max_attempts,
+                priority=priority,
+                total=len(results) if results else None,
+                results=json.dumps(results) if results else None,
+            ))
+            db.commit()
+        return job_id
+
+    def runnable(self):
+        return and_(
+            Job.kind.in_(list(self.handlers)),
+            or_(
+                and_(Job.status == "queued", Job.run_after <= func.now()),
+                and_(Job.status == "processing", Job.lease_expires_at < func.now()),
+            )
+        )
+
+    def candidates(self, db):
+        """
+        State the scheduler picks from: the first runnable job of each
+        offer, the running jobs and the items ran recently by company and
+        offer, and the current time.
+        """
+        heads = db.query(
+            Job.id, Job.company_id, Job.offer_id, Job.priority, Job.run_after,
+            func.row_number().over(
+                partition_by=(Job.company_id, Job.offer_id),
+                order_by=(Job.priority, Job.run_after),
+            ).label("position"),
+        ).filter(self.runnable()).subquery()
+        candidates = db.query(heads.c.id, heads.c.company_id, heads.c.offer_id,
+                              heads.c.priority, heads.c.run_after) \
+            .filter(heads.c.position == 1).all()
+        if not candidates:
+            return [], {}, {}, None
+
+        running = {(company_id, offer_id): count for company_id, offer_id, count in db.query(
+            Job.company_id, Job.offer_id, func.count(Job.id)
+        ).filter(
+            Job.status == "processing", Job.lease_expires_at >= func.now()
+        ).group_by(Job.company_id, Job.offer_id).all()}
+
+        window = timedelta(seconds=JOB_FAIR_SHARE_WINDOW)
+        service = {(company_id, offer_id): items for company_id, offer_id, items in db.query(
+            Job.company_id, Job.offer_id, func.sum(func.coalesce(Job.total, 1))
+        ).filter(
+            Job.attempts > 0,
+            or_(Job.status == "processing", Job.modified_date >= func.localtimestamp() - window),
+        ).group_by(Job.company_id, Job.offer_id).all()}
+
+        now = db.query(func.localtimestamp()).scalar()
+        return candidates, running, service, now
+
+    def claim(self, worker_id):
+        """
+        Lease the next job to a worker, as picked by the scheduler among the
+        runnable ones. Returns (id, kind, payload, results, total) or None
+        when there is nothing it can run.
+        """
+        lease = timedelta(seconds=self.lease_seconds)
+        with SessionLocal() as db:
+            while True:
+                job = None
+                for job_id in self.scheduler.order(*self.candidates(db)):
+                    # Another worker may have claimed it in the meantime
+                    job = db.query(Job).filter(Job.id == job_id, self.runnable()) \
+                        .with_for_update(skip_locked=True).first()
+                    if job is not None:
+                        break
+                if job is None:
+                    db.rollback()
+                    return None
+
+                if job.attempts >= job.max_attempts:
+                    # Its last worker died while running it
+                    job.status = "dead"
+                    job.lease_owner = None
+                    job.message = job.message or "Lease expired on the last attempt"
+                    db.commit()
+                    continue
+
+                job.status = "processing"
+                job.attempts += 1
+                job.lease_owner = worker_id
+                job.lease_expires_at = func.now() + lease
+                job.heartbeat_at = func.now()
+                job.message = "Processing"
+                # Every attempt reports all its items again
+                job.processed = 0
+                db.commit()
+                return (job.id, job.kind, json.loads(job.payload or "{}"),
+                        json.loads(job.results or "{}"), job.total)
+
+    def heartbeat(self, job_id, worker_id) -> bool:
+        """
+        Renew the lease of a running job. Returns False if the worker lost it.
+        """
+        with SessionLocal() as db:
+            renewed = db.execute(update(Job).where(
+                Job.id == job_id, Job.lease_owner == worker_id
+            ).values(
+                lease_expires_at=func.now() + timedelta(seconds=self.lease_seconds),
+                heartbeat_at=func.now(),
+            )).rowcount
+            db.commit()
+        return renewed > 0
+
+    def complete(self, job_id, worker_id, message="Completed"):
+        with SessionLocal() as db:
+            db.execute(update(Job).where(
+                Job.id == job_id, Job.lease_owner == worker_id
+            ).values(status="completed", lease_owner=None, lease_expires_at=None, message=message))
+            db.commit()
+
+    def fail(self, job_id, worker_id, error, retry=True):
+        with SessionLocal() as db:
+            job = db.query(Job).filter(Job.id == job_id, Job.lease_owner == worker_id) \
+                .with_for_update().first()
+            if job is None:
+                return
+            job.lease_owner = None
+            job.lease_expires_at = None
+            if retry and job.attempts < job.max_attempts:
+                delay = min(JOB_RETRY_CAP, JOB_RETRY_BASE * 2 ** (job.attempts - 1))
+                job.status = "queued"
+                job.run_after = func.now() + timedelta(seconds=delay)
+                job.message = f"Retrying in {delay}s after: {error}"
+            else:
+                job.status = "failed" if not retry else "dead"
+                job.message = f"Failed: {error}"
+            db.commit()
+
+    def progress(self) -> JobProgress:
+        """
+        Progress of the job run by the calling thread, None outside a job.
+        """
+        return getattr(self.running, "progress", None)
+
+    def run_job(self, worker_id, job_id, kind, payload, results=None, total=None):
+        done = threading.Event()
+        self.running.progress = JobProgress(job_id, worker_id, results, total)
+
+        def keep_leased():
+            while not done.wait(self.lease_seconds / 3):
+                try:
+                    if not self.heartbeat(job_id, worker_id):
+                        print(f"Job {job_id} lease lost by {worker_id}")
+                        return
+                except Exception as e:
+                    print(f"Job {job_id} heartbeat failed: {str(e)}")
+
+        threading.Thread(target=keep_leased, daemon=True).start()
+        try:
+            func = self.handlers[kind]
+            if inspect.iscoroutinefunction(func):
+                asyncio.run(func(**payload))
+            else:
+                func(**payload)
+        except JobFailed as e:
+            self.running.progress.flush()
+            self.fail(job_id, worker_id, str(e), retry=False)
+        except Exception as e:
+            print(traceback.format_exc())
+            self.running.progress.flush()
+            self.fail(job_id, worker_id, str(e))
+        else:
+            self.running.progress.flush()
+            self.complete(job_id, worker_id)
+        finally:
+            done.set()
+            self.running.progress = None
+
+    def _work(self, worker_id):
+        while not self.stopping.is_set():
+            try:
+                job = self.claim(worker_id)
+            except Exception as e:
+                print(f"Could not claim a job: {str(e)}")
+                job = None
+            if job is None:
+                self.stopping.wait(self.poll_interval)
+                continue
+            self.run_job(worker_id, *job)
+
+    def start(self, workers=JOB_WORKERS):
+        """
+        Start the worker threads of this process.
+        """
+        for index in range(workers - len(self.workers)):
+            worker_id = f"{socket.gethostname()}:{os.getpid()}:{len(self.workers)}"
+            worker = threading.Thread(target=self._work, args=(worker_id,), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self):
+        """
+        Stop claiming jobs. Jobs still running are claimed again by another
+        worker once their lease expires.
+        """
+        self.stopping.set()
+
+    @staticmethod
+    def parse(job, with_results=False) -> dict:
+        status = JOB_STATUS[job.status]
+        task = {"status": status, "message": job.message or status.name.capitalize(),
+                "offer_id": job.offer_id, "task_id": job.id, "kind": job.kind,
+                "attempts": job.attempts, "created_date": job.created_date,
+                "progress": {"processed": job.processed, "total": job.total}}
+        if with_results:
+            task["results"] = json.loads(job.results or "{}")
+        return task
+
+    def get_task(self, task_id):
+        """Returns the status of a given job, with the result of each item."""
+        with SessionLocal() as db:
+            job = db.query(Job).filter(Job.id == task_id).first()
+            return self.parse(job, with_results=True) if job is not None else None
+
+    def get_tasks(self, offer_id=None, limit=JOB_LIST_LIMIT):
+        """
+        Returns the latest jobs of an offer, or every queued and running job.
+        """
+        with SessionLocal() as db:
+            query = db.query(Job).options(defer(Job.payload), defer(Job.results))
+            if offer_id is not None:
+                query = query.filter(Job.offer_id == offer_id)
+            else:
+                query = query.filter(Job.status.in_(["queued", "processing"]))
+            return [self.parse(job) for job in
+                    query.order_by(Job.created_date.desc()).limit(limit).all()]
+
+    @staticmethod
+    def event(job) -> dict:
+        return {"task_id": job.id, "offer_id": job.offer_id, "kind": job.kind,
+                "status": job.status, "message": job.message,
+                "progress": {"processed": job.processed, "total": job.total},
+                "results": json.loads(job.results or "{}")}
+
+    def changed_jobs(self, offer_id=None, task_ids=None, since=None):
+        """
+        Jobs of an offer, or with the given IDs, modified since a time.
+        Without a time, the offer's queued and running jobs are returned.
+        Returns their events and the time to ask from next. That time lags
+        a few seconds so rows written by transactions that started earlier
+        are not missed, callers get some jobs twice.
+        """
+        with SessionLocal() as db:
+            query = db.query(Job).options(defer(Job.payload))
+            if offer_id is not None:
+                query = query.filter(Job.offer_id == offer_id)
+            if task_ids is not None:
+                query = query.filter(Job.id.in_(task_ids))
+            if since is not None:
+                query = query.filter(Job.modified_date >= since)
+            elif task_ids is None:
+                query = query.filter(Job.status.in_(["queued", "processing"]))
+            jobs = query.order_by(Job.modified_date).limit(JOB_LIST_LIMIT).all()
+            now = db.query(func.localtimestamp()).scalar()
+        next_since = now - timedelta(seconds=JOB_EVENTS_LAG)
+        if len(jobs) == JOB_LIST_LIMIT:
+            # Continue from the last one returned
+            next_since = min(next_since, jobs[-1].modified_date)
+        return [self.event(job) for job in jobs], next_since
+
+    async def watch(self, offer_id=None, task_ids=None, poll_interval=JOB_EVENTS_POLL_INTERVAL):
+        """
+        Yield (event, data) pairs as the watched jobs change: a "task" event
+        with the state and progress of a job, and an event named after the
+        new status of each of its items (uploaded, extracted, scored,
+        persisted, failed...). Watching a group of tasks ends once all of
+        them are finished, watching an offer goes on until the caller stops.
+        A ("ping", None) pair is yielded after every look without changes.
+        """
+        loop = asyncio.get_event_loop()
+        tasks, items = {}, {}
+        since = None
+        while True:
+            events, since = await loop.run_in_executor(
+                None, self.changed_jobs, offer_id, task_ids, since)
+            changed = False
+            for event in events:
+                results = event.pop("results")
+                for item, result in results.items():
+                    if items.get((event["task_id"], item)) != result:
+                        items[(event["task_id"], item)] = result
+                        changed = True
+                        yield result["status"], dict(result, task_id=event["task_id"], item=item)
+                if tasks.get(event["task_id"]) != event:
+                    tasks[event["task_id"]] = event
+                    changed = True
+                    yield "task", event
+
+            if task_ids is not None and len(tasks) == len(set(task_ids)) and all(
+                    task["status"] in JOB_FINAL_STATES for task in tasks.values()):
+                return
+            if not changed:
+                yield "ping", None
+            await asyncio.sleep(poll_interval)
+
+
+job_queue = JobQueue()
@@ -0,0 +1,52 @@
+import os
+
+from app.utils.rate_limiter import TokenBucketRateLimiter
+
+# Models of the cheap and fast tier, and of the strong and expensive one
+# Both must support structured outputs (json_schema response format)
+OAI_CHEAP_MODEL = os.getenv("OAI_CHEAP_MODEL", "gpt-4o-mini")
+OAI_STRONG_MODEL = os.getenv("OAI_STRONG_MODEL", "gpt-4o")
+
+
+class ModelRoute:
+    """
+    Model a kind of LLM work is sent to, and the model used instead while
+    that one is rate limited.
+    """
+
+    def __init__(self, name, model, fallback=None):
+        self.name = name
+        self.model = model
+        self.fallback = fallback if fallback != model else None
+
+
+class ModelRouter:
+    """
+    Routes each kind of LLM work to a model:
+    - profile: offer independent field extraction, cheap model
+    - scoring: checking a clear profile against an offer, cheap model
+    - borderline: checking a profile that is incomplete or close to the
+      offer limits, strong model
+    OpenAI quotas are per model, so there is one rate limiter per model.
+    """
+
+    def __init__(self, routes):
+        self.routes = {route.name: route for route in routes}
+        self.rate_limiters = {}
+
+    @classmethod
+    def from_env(cls):
+        return cls([
+            ModelRoute("profile", os.getenv("OAI_PROFILE_MODEL", OAI_CHEAP_MODEL), OAI_STRONG_MODEL),
+            ModelRoute("scoring", os.getenv("OAI_SCORING_MODEL", OAI_CHEAP_MODEL), OAI_STRONG_MODEL),
+            ModelRoute("borderline", os.getenv("OAI_BORDERLINE_MODEL", OAI_STRONG_MODEL), OAI_CHEAP_MODEL),
+        ])
+
+    def route(self, name) -> ModelRoute:
+        return self.routes[name]
+
+    def rate_limiter(self, model) -> TokenBucketRateLimiter:
+        # Quota shared with every other worker process
+        if model not in self.rate_limiters:
+            self.rate_limiters[model] = TokenBucketRateLimiter(f"openai:{model}")
+        return self.rate_limiters[model]
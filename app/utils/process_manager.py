@@ -0,0 +1,149 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import itertools
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+# Seconds past its timeout a task that ignores the alarm, e.g. stuck in
+# native code, is given before its pool is replaced
+HARD_TIMEOUT_GRACE = 30
+# Seconds between checks of a task that is being waited on
+WAIT_INTERVAL = 0.5
+
+
+class ProcessTaskError(Exception):
+    """Raised when a task times out or its worker process dies."""
+
+
+# Queue the worker processes report started tasks on
+_started_queue = None
+
+
+def _init_worker(started_queue):
+    global _started_queue
+    _started_queue = started_queue
+
+
+def _run_task(task_id, timeout, func, *args):
+    """
+    Runs `func` in a worker process. Reports when the task starts, so its
+    timeout doesn't count the time it waited behind other callers' tasks,
+    and interrupts it with an alarm once the timeout is reached.
+    """
+    _started_queue.put(task_id)
+    if timeout is None or not hasattr(signal, "setitimer"):
+        return func(*args)
+
+    def on_alarm(signum, frame):
+        raise ProcessTaskError(f"Task timed out after {timeout} seconds")
+
+    previous = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return func(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+class ProcessPoolManager:
+    """
+    Class that runs CPU bound functions in a pool of worker processes.
+    The pool is shared by every caller. A task's timeout runs from when a
+    worker starts it, and a task that times out is interrupted inside its
+    worker. Only a task stuck past its timeout plus HARD_TIMEOUT_GRACE, or
+    a crashed worker, gets the pool replaced; the tasks it breaks are
+    retried once and the rest of the work carries on.
+    """
+
+    def __init__(self, max_workers=None, timeout=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.executor = None
+        self.lock = threading.Lock()
+        self.task_ids = itertools.count()
+        self.started = {}  # Time each running task was started at
+        self.started_queue = None
+
+    def _track_started(self):
+        while True:
+            task_id = self.started_queue.get()
+            self.started[task_id] = time.monotonic()
+
+    def _get_executor(self):
+        """Returns the current pool, creating it on first use."""
+        with self.lock:
+            if self.executor is None:
+                # Workers are spawned so they don't inherit the server's
+                # threads, sockets or DB connections
+                context = multiprocessing.get_context("spawn")
+                if self.started_queue is None:
+                    self.started_queue = context.Queue()
+                    threading.Thread(target=self._track_started, daemon=True).start()
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=context,
+                    initializer=_init_worker, initargs=(self.started_queue,))
+            return self.executor
+
+    def _restart(self, executor):
+        """Kills the workers of a hung or broken pool and drops it."""
+        with self.lock:
+            if self.executor is not executor:
+                return  # Another caller already replaced it
+            self.executor = None
+        for process in list((executor._processes or {}).values()):
+            process.kill()
+        executor.shutdown(wait=False)
+
+    def run(self, func, *args, timeout=None):
+        """
+        Runs `func` in a worker process and returns its result. Raises
+        ProcessTaskError if it exceeds the timeout or its worker dies.
+        """
+        return self.run_all(func, [args], timeout=timeout)[0]
+
+    def run_all(self, func, args_list, timeout=None):
+        """
+        Runs `func` once per argument tuple and returns the results in
+        order. A failed call yields its exception instead of a result.
+        Calls whose pool was broken by another call are retried once.
+        """
+        results = self._run_all(func, args_list, timeout)
+        for idx, result in enumerate(results):
+            if isinstance(result, BrokenProcessPool):
+                results[idx] = self._run_all(func, [args_list[idx]], timeout)[0]
+        return [ProcessTaskError(f"Worker process crashed: {result}")
+                if isinstance(result, BrokenProcessPool) else result
+                for result in results]
+
+    def _run_all(self, func, args_list, timeout):
+        timeout = timeout if timeout is not None else self.timeout
+        executor = self._get_executor()
+        task_ids = [next(self.task_ids) for _ in args_list]
+        futures = [executor.submit(_run_task, task_id, timeout, func, *args)
+                   for task_id, args in zip(task_ids, args_list)]
+        results = []
+        for task_id, future in zip(task_ids, futures):
+            while True:
+                try:
+                    results.append(future.result(
+                        timeout=WAIT_INTERVAL if timeout is not None else None))
+                except TimeoutError:
+                    # Still queued, or running within its time
+                    started = self.started.get(task_id)
+                    if started is None or time.monotonic() - started <= timeout + HARD_TIMEOUT_GRACE:
+                        continue
+                    # Stuck where the alarm can't interrupt it
+                    self._restart(executor)
+                    results.append(ProcessTaskError(f"Task timed out after {timeout} seconds"))
+                except BrokenProcessPool as e:
+                    self._restart(executor)
+                    results.append(e)
+                except Exception as e:
+                    results.append(e)
+                break
+            self.started.pop(task_id, None)
+        return results
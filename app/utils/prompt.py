@@ -1,11 +1,69 @@
+# Bump whenever a prompt changes, cached results made with older prompts are then ignored
+PROMPT_VERSION = "7"
+PROFILE_PROMPT_VERSION = "2"
+
+# Extracts the data of a candidate that does not depend on the offer, once per CV
+profile_prompt = """
+Actúa como un experto en [Reclutamiento, Selección de Personal, Análisis de
+Hojas de Vida]. El objetivo de este prompt es extraer de las hojas de vida de
+los candidatos sus datos personales y laborales, y entregar un JSON con todos
+los datos recolectados de cada candidato.
+
+Parámetros a Extraer:
+1. Nombre del candidato: Extrae el nombre completo del candidato
+desde el campo correspondiente en su hoja de vida.
+2. Tipo de Documento: Extrae el Tipo de documento del candidato
+3. Número de identificación (Cédula): Extrae el número de
+identificación del candidato.
+4. Ciudad de residencia: Extrae la ciudad donde reside el candidato.
+5. Edad: Extrae la edad del candidato, o calcúlala a partir de su fecha de nacimiento.
+6. Género: Extrae el género del candidato.
+7. Experiencia laboral: Calcula los años de experiencia laboral total del candidato.
+8. Tiempo promedio en cada trabajo: Calcula el promedio de duración en meses
+de cada cargo del candidato.
+9. Nivel educativo: Extrae el máximo nivel educativo alcanzado por el candidato.
+10. Móvil (Teléfono de contacto): Extrae el número móvil del candidato.
+11. Correo electrónico: Extrae el correo electrónico del candidato.
+
+El puntaje del candidato lo calcula el sistema a partir de los años de experiencia
+("experiencia_en_anos") y el tiempo promedio en meses en cada trabajo
+("tiempo_promedio_en_cada_trabajo"), por lo que estos valores deben ser lo más
+exactos posible.
+
+Ejemplo de JSON con los datos de un candidato:
+{{
+    "candidato_id": "CV-1",
+    "nombre": "Juan Perez",
+    "cedula": "80000000",
+    "tipo_documento": "CC",
+    "ciudad": "Bogota",
+    "genero": "Hombre",
+    "movil": "3105555555",
+    "correo": "juan@gmail.com",
+    "experiencia_en_anos": 10,
+    "tiempo_promedio_en_cada_trabajo": 36,
+    "nivel_educativo": "Universitario",
+    "edad": 30
+}}
+
+### Instrucciones:
+A continuación, se presentan los textos completos de los CVs de los candidatos. Cada CV va
+precedido de su identificador (por ejemplo ### CV-1 ###). Devuelve un único JSON con la
+lista "candidatos", un elemento por CV con su identificador copiado tal cual en
+"candidato_id" y los datos extraídos. Usa null para los datos que no aparezcan en el CV.
+
+
+
+### Textos de los CVs:
+{cv_texts}
+    """
+
+# Evaluates candidate profiles against the mandatory variables of an offer
 prompt = """
 Actúa como un experto en [Reclutamiento, Selección de Personal, Análisis de
-Hojas de Vida]. El objetivo de este super prompt es evaluar y calificar las hojas de
-vida de candidatos con base en una serie de criterios predefinidos. El sistema
-debe identificar las habilidades del candidato y compararlas con las solicitadas,
-calcular un puntaje general basado en diversos factores (habilidades, experiencia,
-tiempo promedio en cada cargo, nivel educativo, entre otros), y finalmente
-entregar un JSON con todos los datos recolectados del candidato.
+Hojas de Vida]. El objetivo de este prompt es evaluar si los candidatos cumplen
+con los criterios obligatorios de una oferta, a partir del perfil extraído de su
+hoja de vida, y entregar un JSON con el estado de cada candidato.
 
 Variables Obligatorias:
 Se deben recibir y validar las siguientes variables de la oferta inicial. Si el
@@ -19,10 +77,10 @@ marcará como “No apto” en el campo Status:
 
 Comparación de Variables Obligatorias:
 Estas comparaciones se deben realizar en el siguiente orden:
-1. Ciudad: Comparar la ciudad de residencia extraída del candidato con
+1. Ciudad: Comparar la ciudad de residencia del candidato con
 la ciudad especificada en la oferta. Si no coinciden, el candidato se marcará como
 “No apto”.
-2. Edad: Comparar la edad extraída del candidato con el rango de edad
+2. Edad: Comparar la edad del candidato con el rango de edad
 especificado en la oferta. Si no se encuentra dentro del rango, el candidato se
 marcará como “No apto”.
 3. Género: Comparar el género del candidato con el género
@@ -32,66 +90,27 @@ apto”.
 la experiencia mínima requerida en la oferta. Si no cumple con el mínimo
 requerido, el candidato se marcará como “No apto”.
 
-Parámetros a Extraer:
-1. Nombre del candidato: Extrae el nombre completo del candidato
-desde el campo correspondiente en su hoja de vida.
-2. Tipo de Documento: Extrae el Tipo de documento del candidato
-3. Número de identificación (Cédula): Extrae el número de
-identificación del candidato.
-4. Ciudad de residencia: Extrae la ciudad donde reside el candidato y
-compárala con la ciudad requerida en la oferta.
-5. Edad: Extrae la edad del candidato y verifica que esté dentro del
-rango de edad especificado en la oferta.
-6. Género: Extrae el género del candidato y verifica que coincida con el
-género especificado en la oferta.
-7. Experiencia laboral: Extrae los años de experiencia del candidato y
-verifica si cumple con la experiencia mínima requerida en la oferta.
-8. Habilidades encontradas vs Habilidades solicitadas: Compara las
-habilidades descritas en la hoja de vida del candidato con las habilidades
-solicitadas en la plataforma y genera una lista de coincidencias.
-9. Móvil (Teléfono de contacto): Extrae el número móvil del candidato.
-10. Correo electrónico: Extrae el correo electrónico del candidato.
-11. Score: Calcula el puntaje del candidato con base en habilidades,
-    experiencia, tiempo promedio en cada cargo, nivel educativo, género, ciudad de
-    residencia, entre otros factores.
-
-Ecuación del Score Final:
-Score HET:
-- H (Habilidades): Evaluar el grado de coincidencia entre las habilidades requeridas y las habilidades del candidato (escala de 0 a 10).
-- E (Experiencia): La experiencia laboral total en años del candidato (normalizada a una escala de 0 a 10).
-- T (Tiempo promedio en cada trabajo): Promedio de duración en meses de cada cargo del candidato (normalizado a una escala de 0 a 10).
+Un dato que no aparece en el perfil (null) no es motivo para descartar al candidato.
 
 Habilidades Solicitadas:
 Las habilidades solicitadas en esta oferta son las siguientes: {skills_list_str}
 
-Ejemplo de JSON con los datos de un candidato:
+Ejemplo de JSON con el estado de un candidato:
 {{
-    "nombre": "Juan Perez",
-    "cedula": "80000000",
-    "tipo_documento": "CC",
-    "ciudad": "Bogota",
-    "habilidades_encontradas": ["Habilidad1", "Habilidad2", "Habilidad3"],
-    "habilidades_solicitadas": ["Habilidad1", "Habilidad2", "Habilidad3"],
-    "genero": "Hombre",
-    "movil": "3105555555",
-    "correo": "juan@gmail.com",
-    "score": 7.8,
-    "experiencia_en_anos": 10,
-    "tiempo_promedio_en_cada_trabajo": 36,
-    "nivel_educativo": "Universitario",
-    "edad": 30,
+    "candidato_id": "CV-1",
     "status": "Apto"
 }}
 
 ### Instrucciones:
-A continuación, se presentan los textos completos de los CVs de los candidatos para evaluar. Por cada CV:
-1. Evalúa las variables obligatorias (Ciudad, Edad, Género, Experiencia, habilidades).
-2. **Busca explícitamente palabras o frases en el texto que indiquen habilidades técnicas o blandas.** Comparar estas habilidades extraídas con las habilidades solicitadas y llena los campos "habilidades encontradas" y "habilidades solicitadas".
-3. Extrae la información relevante (nombre, cédula, ciudad, móvil, correo, etc.) y calcula el score final.
-4. Devuelve un único JSON que contenga una lista de candidatos con el estado (apto/no apto) y los datos extraídos en el siguiente formato:
+A continuación, se presentan los perfiles de los candidatos para evaluar. Cada perfil va
+precedido de su identificador (por ejemplo ### CV-1 ###) e indica en "Habilidades detectadas"
+las habilidades solicitadas que se encontraron en su CV. Por cada candidato:
+1. Evalúa las variables obligatorias (Ciudad, Edad, Género, Experiencia).
+2. Devuelve un único JSON con la lista "candidatos", un elemento por candidato con su
+identificador copiado tal cual en "candidato_id" y el estado (Apto/No apto).
 
 
 
-### Textos de los CVs para Evaluar:
-{cv_texts}
+### Perfiles de los Candidatos para Evaluar:
+{candidates}
     """
@@ -0,0 +1,169 @@
+import asyncio
+import os
+import random
+import re
+import time
+
+from sqlalchemy.dialects.postgresql import insert
+
+from db.session import SessionLocal
+from models.models import LLMRateLimit
+
+# OpenAI quota shared by every worker process, per minute
+OAI_REQUESTS_PER_MINUTE = int(os.getenv("OAI_REQUESTS_PER_MINUTE", "500"))
+OAI_TOKENS_PER_MINUTE = int(os.getenv("OAI_TOKENS_PER_MINUTE", "300000"))
+
+# Backoff after a rate limit error: base * 2^attempt seconds, capped, with full jitter
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: str):
+    """
+    Parse the durations used by OpenAI's rate limit headers, e.g. "6m0s",
+    "1.5s" or "20ms". Returns seconds, or None when it can't be parsed.
+    """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def backoff_delay(attempt: int) -> float:
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def retry_after(headers) -> float:
+    """
+    Seconds the provider asks to wait before retrying, if it says so.
+    """
+    if headers is None:
+        return None
+    retry_ms = headers.get("retry-after-ms")
+    if retry_ms:
+        try:
+            return float(retry_ms) / 1000
+        except ValueError:
+            pass
+    return parse_duration(headers.get("retry-after"))
+
+
+class TokenBucketRateLimiter:
+    """
+    Token buckets for requests and tokens per minute, stored in the
+    llmRateLimit table so every worker process on every node draws from the
+    same quota. Rows are locked with SELECT ... FOR UPDATE while refilled.
+    """
+
+    def __init__(self, name, requests_per_minute=OAI_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=OAI_TOKENS_PER_MINUTE):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+    def _locked_bucket(self, db, now):
+        db.execute(insert(LLMRateLimit).values(
+            name=self.name,
+            requests=self.requests_per_minute,
+            tokens=self.tokens_per_minute,
+            updated_at=now,
+            paused_until=0,
+        ).on_conflict_do_nothing())
+        bucket = db.query(LLMRateLimit).filter(LLMRateLimit.name == self.name).with_for_update().one()
+
+        # Refill both buckets for the time elapsed since the last update
+        elapsed = max(now - bucket.updated_at, 0)
+        bucket.requests = min(self.requests_per_minute,
+                              bucket.requests + elapsed * self.requests_per_minute / 60)
+        bucket.tokens = min(self.tokens_per_minute,
+                            bucket.tokens + elapsed * self.tokens_per_minute / 60)
+        bucket.updated_at = now
+        return bucket
+
+    def try_acquire(self, tokens: int) -> float:
+        """
+        Take one request and `tokens` tokens from the buckets. Returns 0 when
+        they were taken, otherwise the seconds to wait before trying again.
+        """
+        # A request larger than the whole bucket would never fit
+        tokens = min(tokens, self.tokens_per_minute)
+        now = time.time()
+        with SessionLocal() as db:
+            bucket = self._locked_bucket(db, now)
+            if bucket.paused_until > now:
+                wait = bucket.paused_until - now
+            elif bucket.requests >= 1 and bucket.tokens >= tokens:
+                bucket.requests -= 1
+                bucket.tokens -= tokens
+                wait = 0
+            else:
+                wait = max((1 - bucket.requests) * 60 / self.requests_per_minute,
+                           (tokens - bucket.tokens) * 60 / self.tokens_per_minute)
+            db.commit()
+        return wait
+
+    def sync_headers(self, headers):
+        """
+        Lower the buckets to what the provider reports as remaining, so
+        usage from outside this limiter (or underestimated) is accounted for.
+        """
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        if remaining_requests is None and remaining_tokens is None:
+            return
+        with SessionLocal() as db:
+            bucket = self._locked_bucket(db, time.time())
+            if remaining_requests is not None:
+                bucket.requests = min(bucket.requests, float(remaining_requests))
+            if remaining_tokens is not None:
+                bucket.tokens = min(bucket.tokens, float(remaining_tokens))
+            db.commit()
+
+    def pause(self, seconds: float):
+        """
+        Stop every worker from sending requests for `seconds`.
+        """
+        with SessionLocal() as db:
+            now = time.time()
+            bucket = self._locked_bucket(db, now)
+            bucket.paused_until = max(bucket.paused_until, now + seconds)
+            db.commit()
+
+    async def acquire(self, tokens: int):
+        """
+        Wait until the shared quota allows a request of `tokens` tokens.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                wait = await loop.run_in_executor(None, self.try_acquire, tokens)
+            except Exception as e:
+                # Never block scoring because the limiter's store is unavailable
+                print(f"Rate limiter unavailable, sending request unthrottled: {str(e)}")
+                return
+            if wait <= 0:
+                return
+            # Jitter so waiting workers don't retry in lockstep
+            await asyncio.sleep(wait + random.uniform(0, 0.25))
+
+    async def report(self, headers=None, pause: float = None):
+        """
+        Feed the provider's rate limit headers and pauses back to the store.
+        """
+        loop = asyncio.get_event_loop()
+        try:
+            if pause:
+                await loop.run_in_executor(None, self.pause, pause)
+            if headers is not None:
+                await loop.run_in_executor(None, self.sync_headers, headers)
+        except Exception as e:
+            print(f"Could not update rate limiter: {str(e)}")
@@ -0,0 +1,68 @@
+import os
+from typing import List
+import zlib
+
+import numpy as np
+
+from app.utils.text_normalize import fold_text
+
+# Rank CVs by similarity to the offer and only send the most relevant to the LLM
+PRERANK_ENABLED = os.getenv("PRERANK_ENABLED", "false").lower() == "true"
+# Most relevant CVs of each job sent to the LLM, 0 for no limit. Requests larger
+# than JOB_MAX_ITEMS are split into jobs, each ranked as a whole before scoring
+PRERANK_TOP_K = int(os.getenv("PRERANK_TOP_K", "0"))
+# Cosine similarity a CV needs to be sent to the LLM
+PRERANK_MIN_SIMILARITY = float(os.getenv("PRERANK_MIN_SIMILARITY", "0"))
+# Buckets words are hashed into, instead of keeping a vocabulary
+HASH_FEATURES = 2 ** 15
+
+STOPWORDS = {
+    "con", "del", "las", "los", "por", "para", "una", "uno", "que", "como", "sus",
+    "entre", "sobre", "desde", "hasta", "the", "and", "for", "with",
+}
+
+
+def word_buckets(text: str) -> np.ndarray:
+    words = [word for word in fold_text(text).split()
+             if len(word) > 2 and word not in STOPWORDS and not word.isdigit()]
+    return np.array([zlib.crc32(word.encode("utf-8")) % HASH_FEATURES for word in words],
+                    dtype=np.int64)
+
+
+def relevance_scores(cv_texts: List[str], offer_text: str) -> np.ndarray:
+    """
+    Cosine similarity between the TF-IDF vector of each CV and the offer's,
+    over hashed bag-of-words features. IDF is computed over the CVs given.
+    Each document is kept as its (bucket, count) pairs, so memory grows with
+    the words of the CVs, not with CVs x HASH_FEATURES.
+    """
+    if not cv_texts:
+        return np.zeros(0)
+    documents = [np.unique(word_buckets(text or ""), return_counts=True)
+                 for text in [offer_text] + list(cv_texts)]
+
+    document_frequency = np.zeros(HASH_FEATURES, dtype=np.int64)
+    for buckets, _ in documents:
+        document_frequency[buckets] += 1
+    idf = np.log((1 + len(documents)) / (1 + document_frequency)) + 1
+
+    def tfidf(buckets, counts):
+        weights = np.log1p(counts) * idf[buckets]
+        norm = np.linalg.norm(weights)
+        return weights / norm if norm > 0 else weights
+
+    offer = np.zeros(HASH_FEATURES)
+    offer_buckets, offer_counts = documents[0]
+    offer[offer_buckets] = tfidf(offer_buckets, offer_counts)
+    return np.array([float(tfidf(buckets, counts) @ offer[buckets])
+                     for buckets, counts in documents[1:]])
+
+
+def select_relevant(similarities: np.ndarray, top_k: int = PRERANK_TOP_K,
+                    min_similarity: float = PRERANK_MIN_SIMILARITY) -> List[int]:
+    """
+    Indexes of the CVs worth scoring, most relevant first.
+    """
+    ranked = [int(idx) for idx in np.argsort(-similarities, kind="stable")
+              if similarities[idx] >= min_similarity]
+    return ranked[:top_k] if top_k > 0 else ranked
@@ -0,0 +1,104 @@
+from collections import deque
+import re
+from typing import Dict, List
+
+from app.utils.text_normalize import fold_text
+
+# Parts of a skill name that are also matched alone, e.g. "Excel / Office"
+ALTERNATIVES_RE = re.compile(r"[/|,;]")
+# Qualifiers of a skill, e.g. "Inglés (avanzado)", only matched along with the name
+QUALIFIER_RE = re.compile(r"\([^)]*\)")
+# Names whose symbols tell them apart, folding would turn "C++" and "C#" into "c"
+SYMBOL_NAMES_RE = re.compile(r"(?<![\w.+#])(c\+\+|c#|f#|\.net)(?![\w+#])", re.IGNORECASE)
+SYMBOL_TOKENS = {"c++": " cplusplus ", "c#": " csharp ", "f#": " fsharp ", ".net": " dotnet "}
+# Words that can't make a pattern on their own
+STOPWORDS = {
+    "a", "al", "de", "del", "el", "en", "la", "las", "los", "o", "para", "por", "y", "con",
+    "the", "and", "of", "in", "for", "with",
+}
+
+
+def fold_skill_text(text: str) -> str:
+    """
+    Folded text with symbol-bearing names, e.g. "C++" or ".NET", kept as
+    their own tokens.
+    """
+    return fold_text(SYMBOL_NAMES_RE.sub(lambda match: SYMBOL_TOKENS[match.group(1).lower()],
+                                         str(text or "")))
+
+
+def is_pattern(pattern: str) -> bool:
+    words = pattern.split()
+    return len(pattern) >= 2 and any(word not in STOPWORDS for word in words)
+
+
+def skill_patterns(name: str) -> List[str]:
+    """
+    Folded forms of a skill name a CV may use: the full name, the name
+    without its qualifiers, and each of the alternatives it lists.
+    Single letters and stopwords are left out, they match anywhere.
+    """
+    base = QUALIFIER_RE.sub(" ", name)
+    patterns = [fold_skill_text(name), fold_skill_text(base)]
+    parts = [fold_skill_text(part) for part in ALTERNATIVES_RE.split(base)]
+    if len(parts) > 1:
+        patterns.extend(parts)
+    return [pattern for pattern in dict.fromkeys(patterns) if is_pattern(pattern)]
+
+
+class SkillMatcher:
+    """
+    Aho-Corasick automaton over the words of the skill patterns, so every
+    skill is found in a single pass over a CV and only on word boundaries.
+    """
+
+    def __init__(self, skills: List[str], synonyms: Dict[str, List[str]] = None):
+        self.skills = list(dict.fromkeys(skills))
+        self.goto = [{}]  # Word transitions of each state
+        self.fail = [0]  # Longest proper suffix state of each state
+        self.output = [set()]  # Skills that end at each state
+        synonyms = synonyms or {}
+        for skill in self.skills:
+            for name in [skill] + list(synonyms.get(skill, [])):
+                for pattern in skill_patterns(name):
+                    self._add(pattern.split(), skill)
+        self._build()
+
+    def _add(self, words: List[str], skill: str):
+        state = 0
+        for word in words:
+            if word not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(set())
+                self.goto[state][word] = len(self.goto) - 1
+            state = self.goto[state][word]
+        self.output[state].add(skill)
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and word not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(word, 0)
+                self.output[next_state] |= self.output[self.fail[next_state]]
+
+    def match(self, text: str) -> List[str]:
+        """
+        Skills found in the text, in the order they were given.
+        """
+        found = set()
+        state = 0
+        for word in fold_skill_text(text).split():
+            while state and word not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(word, 0)
+            found |= self.output[state]
+        return [skill for skill in self.skills if skill in found]
+
+    def match_many(self, texts: List[str]) -> List[List[str]]:
+        return [self.match(text) for text in texts]
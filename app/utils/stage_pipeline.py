@@ -0,0 +1,99 @@
+import os
+import queue
+import threading
+import traceback
+
+# Chunks waiting in front of each stage before the previous one blocks
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "2"))
+
+# Marks the end of the input of a stage
+_DONE = object()
+
+
+class Stage:
+    """
+    Step of a StagedPipeline: `func` takes a chunk and returns the chunk
+    handed to the next stage, or None to drop it. It runs in `workers`
+    threads fed by a queue of at most `queue_size` chunks.
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=PIPELINE_QUEUE_SIZE):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+
+
+class StagedPipeline:
+    """
+    Runs chunks of work through a sequence of stages, each with its own
+    worker threads and bounded input queue. Stages work on different chunks
+    at the same time, e.g. extracting the text of one chunk while another
+    waits on the LLM. A stage that falls behind fills its queue, which
+    blocks the stage before it, so no stage runs ahead of the slowest one
+    by more than its queue.
+    A chunk whose stage raises is dropped and passed with the exception to
+    `on_error(stage_name, chunk, error)`, the rest carry on.
+    """
+
+    def __init__(self, stages, on_error=None):
+        self.stages = stages
+        self.on_error = on_error
+
+    def _work(self, index, queues, remaining, lock, outputs):
+        stage = self.stages[index]
+        while True:
+            chunk = queues[index].get()
+            if chunk is _DONE:
+                break
+            try:
+                chunk = stage.func(chunk)
+            except Exception as e:
+                print(traceback.format_exc())
+                print(f"Pipeline stage {stage.name} failed: {str(e)}")
+                if self.on_error is not None:
+                    self.on_error(stage.name, chunk, e)
+                continue
+            if chunk is None:
+                continue
+            if index + 1 < len(self.stages):
+                queues[index + 1].put(chunk)
+            else:
+                with lock:
+                    outputs.append(chunk)
+
+        with lock:
+            remaining[index] -= 1
+            last = remaining[index] == 0
+        if last and index + 1 < len(self.stages):
+            # The last worker out tells every worker of the next stage to finish
+            for _ in range(self.stages[index + 1].workers):
+                queues[index + 1].put(_DONE)
+
+    def run(self, chunks) -> list:
+        """
+        Feed the chunks through every stage and wait until all are done.
+        Returns the chunks the last stage returned, in completion order.
+        """
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        remaining = [stage.workers for stage in self.stages]
+        lock = threading.Lock()
+        outputs = []
+        threads = [
+            threading.Thread(target=self._work, args=(index, queues, remaining, lock, outputs),
+                             name=f"pipeline-{stage.name}-{worker}", daemon=True)
+            for index, stage in enumerate(self.stages)
+            for worker in range(stage.workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        # Blocks while the first stage is behind
+        for chunk in chunks:
+            queues[0].put(chunk)
+        for _ in range(self.stages[0].workers):
+            queues[0].put(_DONE)
+
+        for thread in threads:
+            thread.join()
+        return outputs
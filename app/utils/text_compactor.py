@@ -0,0 +1,128 @@
+from collections import Counter
+import os
+import re
+import unicodedata
+
+# Maximum tokens of a single CV sent to the LLM
+CV_TOKEN_BUDGET = int(os.getenv("CV_TOKEN_BUDGET", "3000"))
+# Tokenizer of the scoring models
+TOKENIZER_ENCODING = "cl100k_base"
+
+# Lines that are explicitly a page number, e.g. "Página 2 de 3", "Page 2", "2/3"
+PAGE_NUMBER_RE = re.compile(r"^(p[aá]g(ina|e)?\.?\s*\d+(\s*(de|of|/)\s*\d+)?|\d+\s*(de|of|/)\s*\d+)$",
+                            re.IGNORECASE)
+# Lines that are only a number, page numbers or values such as an age or a phone
+BARE_NUMBER_RE = re.compile(r"^\d{1,3}$")
+# Lines between two page numbers, at least
+MIN_PAGE_LINES = 10
+SPACES_RE = re.compile(r"[ \t\f\v ]+")
+
+_encoding = None
+
+
+def get_encoding():
+    """
+    Returns the local tokenizer, or None when tiktoken can't be loaded.
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            print(f"Tokenizer unavailable, estimating tokens from length: {str(e)}")
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    encoding = get_encoding()
+    if encoding is None:
+        # Roughly four characters per token for Spanish and English text
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    encoding = get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def is_noise(line: str) -> bool:
+    """
+    OCR noise: lines made mostly of symbols, or stray characters. A single
+    digit is not noise, it may be the value of the label above it.
+    """
+    alnum = sum(1 for char in line if char.isalnum())
+    return alnum == 0 or (len(line) > 3 and alnum / len(line) < 0.5) or \
+        (len(line) == 1 and not line.isdigit())
+
+
+def bare_page_numbers(lines) -> set:
+    """
+    Indexes of the lines that are only a page number: bare numbers that count
+    up by one from 1 or 2, at least MIN_PAGE_LINES lines apart. Any other
+    bare number is a value (age, years, phone...) and is kept.
+    """
+    numbers = [(idx, int(line)) for idx, line in enumerate(lines) if BARE_NUMBER_RE.match(line)]
+    pages = []
+    for start, (first_idx, first_value) in enumerate(numbers):
+        if first_value not in (1, 2):
+            continue
+        chain = [first_idx]
+        for idx, value in numbers[start + 1:]:
+            if value == first_value + len(chain) and idx - chain[-1] >= MIN_PAGE_LINES:
+                chain.append(idx)
+        if len(chain) > len(pages):
+            pages = chain
+    return set(pages) if len(pages) >= 2 else set()
+
+
+def compact_cv_text(text: str, max_tokens: int = CV_TOKEN_BUDGET) -> str:
+    """
+    Normalize a CV text before prompting: collapse whitespace, drop page
+    numbers, OCR noise and headers/footers repeated on every page, and cap
+    the result at `max_tokens`.
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text)
+    lines = [SPACES_RE.sub(" ", line).strip() for line in text.splitlines()]
+
+    # Headers and footers repeat with only the page number changing. Short
+    # labels such as "Funciones:" also repeat but carry the CV's structure
+    def artifact_key(line):
+        if len(line) < 15 and not any(char.isdigit() for char in line):
+            return None
+        if not any(char.isalpha() for char in line):
+            # Bare values such as phones or years are not headers
+            return None
+        return re.sub(r"\d+", "#", line.lower())
+    repeated = {key for key, count in Counter(artifact_key(line) for line in lines if line).items()
+                if key is not None and count >= 3}
+
+    page_numbers = bare_page_numbers(lines)
+    compacted = []
+    seen_artifacts = set()
+    for idx, line in enumerate(lines):
+        if not line:
+            # Keep a single blank line between blocks
+            if compacted and compacted[-1]:
+                compacted.append("")
+            continue
+        if idx in page_numbers or PAGE_NUMBER_RE.match(line) or is_noise(line):
+            continue
+        key = artifact_key(line)
+        if key in repeated:
+            # Keep the first occurrence, it may hold the candidate's name
+            if key in seen_artifacts:
+                continue
+            seen_artifacts.add(key)
+        compacted.append(line)
+
+    return truncate_to_tokens("\n".join(compacted).strip(), max_tokens)
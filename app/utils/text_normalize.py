@@ -0,0 +1,16 @@
+import re
+import unicodedata
+
+NON_WORD_RE = re.compile(r"[^a-z0-9]+")
+
+
+def fold_text(text: str) -> str:
+    """
+    Lowercase text without accents and with every run of symbols and spaces
+    replaced by a single space, e.g. "Bogotá, D.C." -> "bogota d c".
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return NON_WORD_RE.sub(" ", text.lower()).strip()
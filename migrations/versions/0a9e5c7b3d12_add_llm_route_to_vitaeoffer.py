@@ -0,0 +1,31 @@
+"""Add LLM route columns to vitaeOffer
+
+Revision ID: 0a9e5c7b3d12
+Revises: f1b83d6c2a94
+Create Date: 2025-04-14 10:41:07.264915
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0a9e5c7b3d12'
+down_revision: Union[str, None] = 'f1b83d6c2a94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    # Model route, model, latency and tokens of the LLM result of each candidate
+    op.add_column('vitaeOffer', sa.Column('llm_route', sa.String(), nullable=True))
+    op.add_column('vitaeOffer', sa.Column('llm_model', sa.String(), nullable=True))
+    op.add_column('vitaeOffer', sa.Column('llm_latency', sa.Float(), nullable=True))
+    op.add_column('vitaeOffer', sa.Column('llm_tokens', sa.Integer(), nullable=True))
+
+def downgrade():
+    op.drop_column('vitaeOffer', 'llm_tokens')
+    op.drop_column('vitaeOffer', 'llm_latency')
+    op.drop_column('vitaeOffer', 'llm_model')
+    op.drop_column('vitaeOffer', 'llm_route')
@@ -0,0 +1,46 @@
+"""Add jobs table
+
+Revision ID: 1c4f8a2e6b70
+Revises: 0a9e5c7b3d12
+Create Date: 2025-04-21 16:22:48.905371
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '1c4f8a2e6b70'
+down_revision: Union[str, None] = '0a9e5c7b3d12'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    # Durable queue of background jobs, claimed by workers with leases
+    op.create_table(
+        'jobs',
+        sa.Column('id', sa.String(length=36), primary_key=True),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=True),
+        sa.Column('status', sa.Enum('queued', 'processing', 'completed', 'failed', 'dead', name='job_status_enum'),
+                  server_default='queued', nullable=False),
+        sa.Column('offer_id', sa.Integer(), sa.ForeignKey('offers.id'), nullable=True),
+        sa.Column('company_id', sa.Integer(), sa.ForeignKey('company.id'), nullable=True),
+        sa.Column('attempts', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('max_attempts', sa.Integer(), server_default=sa.text('3'), nullable=False),
+        sa.Column('run_after', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+        sa.Column('lease_owner', sa.String(), nullable=True),
+        sa.Column('lease_expires_at', sa.DateTime(), nullable=True),
+        sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+        sa.Column('message', sa.Text(), nullable=True),
+        sa.Column('created_date', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+        sa.Column('modified_date', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+    )
+    op.create_index('ix_jobs_status_run_after', 'jobs', ['status', 'run_after'])
+
+def downgrade():
+    op.drop_index('ix_jobs_status_run_after', table_name='jobs')
+    op.drop_table('jobs')
+    sa.Enum(name='job_status_enum').drop(op.get_bind(), checkfirst=True)
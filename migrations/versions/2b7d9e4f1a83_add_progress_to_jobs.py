@@ -0,0 +1,31 @@
+"""Add progress and results to jobs
+
+Revision ID: 2b7d9e4f1a83
+Revises: 1c4f8a2e6b70
+Create Date: 2025-04-23 10:41:17.284630
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '2b7d9e4f1a83'
+down_revision: Union[str, None] = '1c4f8a2e6b70'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    # Task status queried by any worker: progress, per item results and tasks of an offer
+    op.add_column('jobs', sa.Column('total', sa.Integer(), nullable=True))
+    op.add_column('jobs', sa.Column('processed', sa.Integer(), server_default=sa.text('0'), nullable=False))
+    op.add_column('jobs', sa.Column('results', sa.Text(), nullable=True))
+    op.create_index('ix_jobs_offer_id_created_date', 'jobs', ['offer_id', 'created_date'])
+
+def downgrade():
+    op.drop_index('ix_jobs_offer_id_created_date', table_name='jobs')
+    op.drop_column('jobs', 'results')
+    op.drop_column('jobs', 'processed')
+    op.drop_column('jobs', 'total')
@@ -0,0 +1,27 @@
+"""Add priority lane to jobs
+
+Revision ID: 3e5a1c8d7f26
+Revises: 2b7d9e4f1a83
+Create Date: 2025-04-25 09:12:36.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '3e5a1c8d7f26'
+down_revision: Union[str, None] = '2b7d9e4f1a83'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    # Fair-share scheduling: priority lanes and the work each company ran recently
+    op.add_column('jobs', sa.Column('priority', sa.Integer(), server_default=sa.text('1'), nullable=False))
+    op.create_index('ix_jobs_company_id_modified_date', 'jobs', ['company_id', 'modified_date'])
+
+def downgrade():
+    op.drop_index('ix_jobs_company_id_modified_date', table_name='jobs')
+    op.drop_column('jobs', 'priority')
@@ -0,0 +1,27 @@
+"""Add content_hash column to CVitae
+
+Revision ID: 4d2a7f1c9b3e
+Revises: 6bbc4090900f
+Create Date: 2025-03-20 10:12:41.518302
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '4d2a7f1c9b3e'
+down_revision: Union[str, None] = '6bbc4090900f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    # SHA-256 of the uploaded file, used to detect duplicated CVs
+    op.add_column('cvitae', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index('ix_cvitae_content_hash', 'cvitae', ['content_hash'])
+
+def downgrade():
+    op.drop_index('ix_cvitae_content_hash', table_name='cvitae')
+    op.drop_column('cvitae', 'content_hash')
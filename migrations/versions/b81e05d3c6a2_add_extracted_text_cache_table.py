@@ -0,0 +1,35 @@
+"""Add extractedText cache table
+
+Revision ID: b81e05d3c6a2
+Revises: 4d2a7f1c9b3e
+Create Date: 2025-03-24 09:41:07.205714
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'b81e05d3c6a2'
+down_revision: Union[str, None] = '4d2a7f1c9b3e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    # Text extracted from each CV file, keyed by file hash and extractor version
+    op.create_table(
+        'extractedText',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('content_hash', sa.String(length=64), nullable=False),
+        sa.Column('extractor_version', sa.String(), nullable=False),
+        sa.Column('text', sa.Text(), nullable=True),
+        sa.Column('page_count', sa.Integer(), nullable=True),
+        sa.Column('method', sa.String(), nullable=True),
+        sa.Column('created_date', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+        sa.UniqueConstraint('content_hash', 'extractor_version', name='uq_extracted_text_hash_version'),
+    )
+
+def downgrade():
+    op.drop_table('extractedText')
@@ -0,0 +1,32 @@
+"""Add llmRateLimit table
+
+Revision ID: c5f9e2a417d8
+Revises: b81e05d3c6a2
+Create Date: 2025-03-28 15:03:22.640918
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5f9e2a417d8'
+down_revision: Union[str, None] = 'b81e05d3c6a2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    # Token buckets shared by every worker process calling the LLM
+    op.create_table(
+        'llmRateLimit',
+        sa.Column('name', sa.String(), primary_key=True),
+        sa.Column('requests', sa.Float(), nullable=False),
+        sa.Column('tokens', sa.Float(), nullable=False),
+        sa.Column('updated_at', sa.Float(), nullable=False),
+        sa.Column('paused_until', sa.Float(), server_default=sa.text('0'), nullable=False),
+    )
+
+def downgrade():
+    op.drop_table('llmRateLimit')
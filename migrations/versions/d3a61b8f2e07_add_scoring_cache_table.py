@@ -0,0 +1,34 @@
+"""Add scoringCache table
+
+Revision ID: d3a61b8f2e07
+Revises: c5f9e2a417d8
+Create Date: 2025-04-02 11:27:54.381276
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3a61b8f2e07'
+down_revision: Union[str, None] = 'c5f9e2a417d8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    # Candidate JSON returned by the LLM, keyed by CV text, offer criteria, prompt and model
+    op.create_table(
+        'scoringCache',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('cache_key', sa.String(length=64), nullable=False),
+        sa.Column('model', sa.String(), nullable=True),
+        sa.Column('prompt_version', sa.String(), nullable=True),
+        sa.Column('response', sa.Text(), nullable=True),
+        sa.Column('created_date', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+        sa.UniqueConstraint('cache_key', name='uq_scoring_cache_key'),
+    )
+
+def downgrade():
+    op.drop_table('scoringCache')
@@ -0,0 +1,26 @@
+"""Add matched_skills to vitaeOffer
+
+Revision ID: e4c7a92d51f3
+Revises: d3a61b8f2e07
+Create Date: 2025-04-07 09:12:40.518233
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import ARRAY
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4c7a92d51f3'
+down_revision: Union[str, None] = 'd3a61b8f2e07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    # Offer skills found in the CV text by the local skill matcher
+    op.add_column('vitaeOffer', sa.Column('matched_skills', ARRAY(sa.String), nullable=True))
+
+def downgrade():
+    op.drop_column('vitaeOffer', 'matched_skills')
@@ -0,0 +1,34 @@
+"""Add candidateProfile table
+
+Revision ID: f1b83d6c2a94
+Revises: e4c7a92d51f3
+Create Date: 2025-04-10 15:03:21.846150
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1b83d6c2a94'
+down_revision: Union[str, None] = 'e4c7a92d51f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    # Offer independent candidate data extracted by the LLM, keyed by CV text, prompt and model
+    op.create_table(
+        'candidateProfile',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('profile_key', sa.String(length=64), nullable=False),
+        sa.Column('model', sa.String(), nullable=True),
+        sa.Column('prompt_version', sa.String(), nullable=True),
+        sa.Column('profile', sa.Text(), nullable=True),
+        sa.Column('created_date', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+        sa.UniqueConstraint('profile_key', name='uq_candidate_profile_key'),
+    )
+
+def downgrade():
+    op.drop_table('candidateProfile')
@@ -1,4 +1,4 @@
-from sqlalchemy import ARRAY, TIMESTAMP, Boolean, Column, Date, DateTime, Enum, Float, ForeignKey, Integer, String, Text, func, text
+from sqlalchemy import ARRAY, TIMESTAMP, Boolean, Column, Date, DateTime, Enum, Float, ForeignKey, Index, Integer, String, Text, UniqueConstraint, func, text
 from sqlalchemy.orm import relationship
 from enum import IntEnum
 
@@ -119,10 +119,83 @@ class CVitae(Base):
     tusdatos_id = Column(String)
     companyId = Column(Integer, ForeignKey('company.id'), nullable=False)
     background_date = Column(Date, nullable=True)
+    content_hash = Column(String(64), index=True)
 
     vitae_company = relationship('Company', back_populates='company_cvs')
     Vitae_offers = relationship('VitaeOffer', back_populates='cvitae')
 
+class ExtractedText(Base):
+    __tablename__ = 'extractedText'
+    __table_args__ = (
+        UniqueConstraint('content_hash', 'extractor_version', name='uq_extracted_text_hash_version'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    content_hash = Column(String(64), nullable=False)
+    extractor_version = Column(String, nullable=False)
+    text = Column(Text)
+    page_count = Column(Integer, nullable=True)
+    method = Column(String)  # text_layer, ocr, mixed or docx
+    created_date = Column(DateTime, server_default=func.now(), nullable=False)
+
+class ScoringCache(Base):
+    __tablename__ = 'scoringCache'
+
+    id = Column(Integer, primary_key=True)
+    cache_key = Column(String(64), nullable=False, unique=True)  # See scoring_cache_key
+    model = Column(String)
+    prompt_version = Column(String)
+    response = Column(Text)  # Candidate JSON returned by the LLM
+    created_date = Column(DateTime, server_default=func.now(), nullable=False)
+
+class CandidateProfile(Base):
+    __tablename__ = 'candidateProfile'
+
+    id = Column(Integer, primary_key=True)
+    profile_key = Column(String(64), nullable=False, unique=True)  # See profile_key
+    model = Column(String)
+    prompt_version = Column(String)
+    profile = Column(Text)  # Offer independent candidate JSON returned by the LLM
+    created_date = Column(DateTime, server_default=func.now(), nullable=False)
+
+class LLMRateLimit(Base):
+    __tablename__ = 'llmRateLimit'
+
+    name = Column(String, primary_key=True)
+    requests = Column(Float, nullable=False)  # Requests left in the bucket
+    tokens = Column(Float, nullable=False)  # Tokens left in the bucket
+    updated_at = Column(Float, nullable=False)  # Epoch seconds of the last refill
+    paused_until = Column(Float, nullable=False, server_default=text('0'))  # Epoch seconds
+
+class Job(Base):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        Index('ix_jobs_status_run_after', 'status', 'run_after'),
+        Index('ix_jobs_offer_id_created_date', 'offer_id', 'created_date'),
+        Index('ix_jobs_company_id_modified_date', 'company_id', 'modified_date'),
+    )
+
+    id = Column(String(36), primary_key=True)
+    kind = Column(String, nullable=False)  # Name of the registered handler
+    payload = Column(Text)  # JSON keyword arguments of the handler
+    status = Column(Enum('queued', 'processing', 'completed', 'failed', 'dead', name='job_status_enum'),
+                    nullable=False, server_default='queued')
+    offer_id = Column(Integer, ForeignKey('offers.id'), nullable=True)
+    company_id = Column(Integer, ForeignKey('company.id'), nullable=True)
+    attempts = Column(Integer, nullable=False, server_default=text('0'))
+    max_attempts = Column(Integer, nullable=False, server_default=text('3'))
+    priority = Column(Integer, nullable=False, server_default=text('1'))  # Lane, 0 is claimed first
+    run_after = Column(DateTime, server_default=func.now(), nullable=False)  # Not claimed before
+    lease_owner = Column(String)  # Worker running the job
+    lease_expires_at = Column(DateTime)  # Claimable again after this if not renewed
+    heartbeat_at = Column(DateTime)
+    message = Column(Text)
+    total = Column(Integer)  # Items (files or CVs) the job processes
+    processed = Column(Integer, nullable=False, server_default=text('0'))  # Items with a final result
+    results = Column(Text)  # JSON result of each item, by file name or CVitae ID
+    created_date = Column(DateTime, server_default=func.now(), nullable=False)
+    modified_date = Column(DateTime, onupdate=func.now(), server_default=func.now(), nullable=False)
+
 class Offer(Base):
     __tablename__ = 'offers'
 
@@ -220,6 +293,11 @@ class VitaeOffer(Base):
     status = Column(Enum('pending', 'hired', 'error_processing', 'rejected', name='status_enum'))
     ai_response = Column(Text)
     response_score = Column(Float)
+    matched_skills = Column(ARRAY(String))
+    llm_route = Column(String)  # How the result was obtained: scoring, borderline, cache, prefilter, prerank
+    llm_model = Column(String)
+    llm_latency = Column(Float)  # Seconds of the LLM request
+    llm_tokens = Column(Integer)  # Share of the LLM request tokens
     whatsapp_status = Column(Enum('notsent', 'pending_response', 'interested', 'not_interested', name='whatsapp_status_enum'))
     smartdataId = Column(String)
     comments = Column(String(160))
@@ -0,0 +1,70 @@
+from difflib import SequenceMatcher
+import os
+import sys
+import time
+
+import fitz
+
+from app.cv.cvExtractor import OcrProfile, ocr_page_image, render_page
+
+# Profiles compared by the benchmark, from fastest to most thorough
+PROFILES = {
+    "legacy_eng": OcrProfile(dpi=200, max_side=100000, grayscale=False, lang="eng"),
+    "fast": OcrProfile(dpi=150, max_side=1800, lang="spa+eng"),
+    "default": OcrProfile(),
+    "binarized": OcrProfile(dpi=200, threshold=170),
+    "accurate": OcrProfile(dpi=300, max_side=3500, lang="spa+eng"),
+}
+
+
+def normalize(text: str) -> list:
+    return text.lower().split()
+
+
+def accuracy(text: str, expected: str) -> float:
+    """
+    Word level similarity between the OCR output and the expected text.
+    """
+    return SequenceMatcher(None, normalize(text), normalize(expected)).ratio()
+
+
+def ocr_document(file_path: str, profile: OcrProfile) -> str:
+    # OCR every page, even those with a text layer, so profiles are comparable
+    with fitz.open(file_path, filetype="pdf") as pdf_doc:
+        return "\n".join(ocr_page_image(render_page(page, profile), profile)
+                         for page in pdf_doc)
+
+
+def run_benchmark(samples_dir: str):
+    samples = sorted(name for name in os.listdir(samples_dir) if name.lower().endswith(".pdf"))
+    if not samples:
+        print(f"No PDF files found in {samples_dir}")
+        return
+
+    print(f"{'profile':<12} {'sec/doc':>8} {'accuracy':>9}")
+    for profile_name, profile in PROFILES.items():
+        elapsed = 0.0
+        scores = []
+        for sample in samples:
+            file_path = os.path.join(samples_dir, sample)
+            start = time.perf_counter()
+            text = ocr_document(file_path, profile)
+            elapsed += time.perf_counter() - start
+
+            # Ground truth lives next to the PDF as <name>.txt
+            expected_path = os.path.splitext(file_path)[0] + ".txt"
+            if os.path.exists(expected_path):
+                with open(expected_path, encoding="utf-8") as expected:
+                    scores.append(accuracy(text, expected.read()))
+
+        score = f"{sum(scores) / len(scores):.3f}" if scores else "n/a"
+        print(f"{profile_name:<12} {elapsed / len(samples):>8.2f} {score:>9}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python ocr_benchmark.py <samples_dir>")
+        print("samples_dir holds scanned CV PDFs, each optionally with a <name>.txt transcription")
+        sys.exit(1)
+
+    run_benchmark(sys.argv[1])
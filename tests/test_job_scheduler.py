@@ -0,0 +1,28 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from app.utils.job_queue import NORMAL_LANE, PRIORITY_LANE, FairShareScheduler  # noqa: E402
+
+NOW = datetime(2026, 1, 1)
+
+
+def test_least_served_company_goes_first():
+    scheduler = FairShareScheduler(weights={}, company_cap=0)
+    candidates = [("a", 1, 10, NORMAL_LANE, NOW), ("b", 2, 20, NORMAL_LANE, NOW)]
+    assert scheduler.order(candidates, {}, {(1, 10): 100, (2, 20): 60}, NOW) == ["b", "a"]
+
+
+def test_offers_of_a_company_queue_fairly():
+    scheduler = FairShareScheduler(weights={}, company_cap=0)
+    candidates = [("a", 1, 10, NORMAL_LANE, NOW - timedelta(seconds=5)),
+                  ("b", 1, 11, NORMAL_LANE, NOW)]
+    assert scheduler.order(candidates, {}, {(1, 10): 100}, NOW) == ["b", "a"]
+
+
+def test_priority_lane_goes_first():
+    scheduler = FairShareScheduler(weights={}, company_cap=0)
+    candidates = [("a", 1, 10, NORMAL_LANE, NOW), ("b", 2, 20, PRIORITY_LANE, NOW)]
+    assert scheduler.order(candidates, {}, {(2, 20): 100}, NOW) == ["b", "a"]
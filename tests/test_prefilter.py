@@ -0,0 +1,26 @@
+from datetime import date
+
+from app.cv.cvPrefilter import extract_experience_years, fold_lines, prefilter_cv
+
+TODAY = date(2026, 10, 17)
+
+
+def test_citizenship_is_not_a_city():
+    cv = "JUAN PEREZ\nCiudadano colombiano\nIngeniero de sistemas"
+    assert prefilter_cv(cv, "Bogotá", None, None, None, TODAY) == []
+    assert prefilter_cv("Ciudadanía: Colombiana", "Bogotá", None, None, None, TODAY) == []
+
+
+def test_city_label_is_compared():
+    assert prefilter_cv("Ciudad: Medellín", "Bogotá", None, None, None, TODAY) == ["Ciudad: medellin"]
+
+
+def test_numeric_date_ranges_count_as_experience():
+    cv = "03/2017 - 05/2024\nEnero 2015 - Diciembre 2016"
+    assert extract_experience_years(fold_lines(cv), TODAY) > 9
+    assert prefilter_cv(cv, None, None, None, 4, TODAY) == []
+
+
+def test_short_experience_is_rejected():
+    cv = "Enero 2025 - actual"
+    assert prefilter_cv(cv, None, None, None, 4, TODAY) == ["Experiencia: 1.8 años"]
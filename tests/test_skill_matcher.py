@@ -0,0 +1,19 @@
+from app.utils.skill_matcher import SkillMatcher
+
+
+def test_qualifiers_are_not_skills():
+    matcher = SkillMatcher(["Inglés (avanzado)"])
+    assert matcher.match("Nivel avanzado de Python") == []
+    assert matcher.match("Inglés avanzado") == ["Inglés (avanzado)"]
+
+
+def test_symbol_names_are_not_single_letters():
+    matcher = SkillMatcher(["C++", "C#", ".NET"])
+    assert matcher.match("Calle 7 # 12 c 45, Bogotá") == []
+    assert matcher.match("Desarrollo en C#, C++ y .NET") == ["C++", "C#", ".NET"]
+
+
+def test_alternatives_are_matched_alone():
+    matcher = SkillMatcher(["Excel / Office", "Atención al cliente (servicio)"])
+    assert matcher.match("Manejo de Excel y atención al cliente") == \
+        ["Excel / Office", "Atención al cliente (servicio)"]
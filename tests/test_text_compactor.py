@@ -0,0 +1,20 @@
+from app.utils.text_compactor import compact_cv_text
+
+
+def test_keeps_values_on_their_own_line():
+    text = ("MARIA GOMEZ\nCédula de ciudadanía\n1020304050\nCelular\n3001234567\n"
+            "Edad\n29\nHijos\n2\nExperiencia\n2018\n2023\n")
+    compacted = compact_cv_text(text).splitlines()
+    for value in ["1020304050", "3001234567", "29", "2", "2018", "2023"]:
+        assert value in compacted
+
+
+def test_drops_page_numbers():
+    page = "\n".join(f"Funciones del cargo {idx}" for idx in range(12))
+    text = f"MARIA GOMEZ\n{page}\n1\n{page}\n2\n{page}\n3\nPágina 4 de 4\n"
+    compacted = compact_cv_text(text).splitlines()
+    assert "1" not in compacted
+    assert "2" not in compacted
+    assert "3" not in compacted
+    assert "Página 4 de 4" not in compacted
+    assert "MARIA GOMEZ" in compacted